@@ -0,0 +1,266 @@
+# Leak rate and pump-down analysis of pressure logs.
+#
+# A log is split into windows of constant valve state (the valves column of
+# pressure_log.py). Every window gets a least squares line through its
+# pressures, which is the leak-up rate while the chamber is isolated, and a
+# line through log(pressure), whose slope is -1/tau of the pump-down while
+# the chamber is pumped. Windows are then checked for anomalies.
+#
+#   result = analyze(LogArchive('pressure_log_').records())
+#   result['leak_rate'][result['kind'] == ISOLATED]
+#   describe_flags(result['flags'][0])
+#
+# The fits only need running sums per window, so the work is done chunk by
+# chunk with NumPy and a window may span chunks. The same Analyzer runs on
+# live data, feed it whatever arrived since the last call:
+#
+#   analyzer = Analyzer()
+#   analyzer.feed_rows([(timestamp, pressure, valves), ...])
+#   analyzer.results(), analyzer.current()
+
+import numpy as np
+
+# window kinds
+ISOLATED = 0  # every valve closed, pressure rises by leaks (and outgassing)
+PUMPING = 1   # isolation valve open to the pump
+DOSING = 2    # a source valve open
+
+# anomaly flags
+HIGH_LEAK = 1   # leak rate above max_leak_rate
+SLOW_PUMP = 2   # pump-down time constant over slow_factor times the median
+POOR_FIT = 4    # r squared of the window's fit below min_r2
+GAP = 8         # samples missing for more than max_gap seconds
+FLAG_NAMES = ((HIGH_LEAK, 'high leak'), (SLOW_PUMP, 'slow pump-down'),
+              (POOR_FIT, 'poor fit'), (GAP, 'gap'))
+
+# valve bits as main_system_control.valve_bits sets them
+PUMP_MASK = 4     # ISOLATION
+SOURCE_MASK = 3   # WATER, FDTS
+
+# per window running sums of a line fit: n, x, y, x*x, x*y, y*y
+FIT_SUMS = 6
+STAT_FIELDS = ('start', 'end', 'valves', 'count', 'p_first', 'p_last', 'max_gap', 'lin', 'log')
+
+
+def describe_flags(flags):
+    return [name for bit, name in FLAG_NAMES if flags & bit]
+
+
+def rows_to_records(rows):
+    # (timestamp, pressure, valves) tuples to an array with the fields analysis uses
+    records = np.zeros(len(rows), dtype=[('time', '<f8'), ('pressure', '<f8'), ('valves', '<u4')])
+    if len(rows):
+        t, p, v = zip(*rows)
+        records['time'] = t
+        records['pressure'] = [np.nan if x is None else x for x in p]
+        records['valves'] = v
+    return records
+
+
+def _fit_sums(x, y, valid, starts):
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+    columns = (valid.astype(np.float64), x, y, x * x, x * y, y * y)
+    return np.column_stack([np.add.reduceat(c, starts) for c in columns])
+
+
+def window_stats(records, origin=None, base_pressure=0.0):
+    # running sums for each run of constant valve state in records, dict of
+    # arrays with one entry per run. origin: start time of a window the
+    # first run continues, times are fitted relative to the window start.
+    # The pump-down fit is of log(pressure - base_pressure) over the samples
+    # at least twice the base pressure, near it the log is only noise
+    t = np.asarray(records['time'], dtype=np.float64)
+    p = np.asarray(records['pressure'], dtype=np.float64)
+    v = np.asarray(records['valves'])
+    n = len(t)
+    starts = np.flatnonzero(np.r_[True, v[1:] != v[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    t0 = t[starts].copy()
+    if origin is not None:
+        t0[0] = origin
+    x = t - np.repeat(t0, ends - starts + 1)
+    valid = ~np.isnan(p)
+    positive = valid & (p > 2 * base_pressure) & (p > 0)
+    gaps = np.r_[0.0, np.diff(t)]
+    gaps[starts] = 0.0
+    return {
+        'start': t0,
+        'end': t[ends],
+        'valves': v[starts],
+        'count': ends - starts + 1,
+        'p_first': p[starts],
+        'p_last': p[ends],
+        'max_gap': np.maximum.reduceat(gaps, starts),
+        'lin': _fit_sums(x, p, valid, starts),
+        'log': _fit_sums(x, np.log(np.where(positive, p - base_pressure, 1.0)), positive, starts),
+    }
+
+
+def _take(stats, selection):
+    return dict((key, stats[key][selection]) for key in STAT_FIELDS)
+
+
+def _join(parts):
+    if not parts:
+        stats = dict((key, np.zeros(0)) for key in STAT_FIELDS)
+        stats.update(lin=np.zeros((0, FIT_SUMS)), log=np.zeros((0, FIT_SUMS)),
+                     valves=np.zeros(0, dtype=np.uint32), count=np.zeros(0, dtype=np.int64))
+        return stats
+    return dict((key, np.concatenate([part[key] for part in parts])) for key in STAT_FIELDS)
+
+
+def line_fit(sums):
+    # slope, intercept and r squared from FIT_SUMS columns, NaN when undefined
+    n, sx, sy, sxx, sxy, syy = sums.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vxx = sxx - sx * sx / n
+        vxy = sxy - sx * sy / n
+        vyy = syy - sy * sy / n
+        slope = vxy / vxx
+        intercept = (sy - slope * sx) / n
+        r2 = np.where(vyy > 0, vxy * vxy / (vxx * vyy), 1.0)
+    r2[n < 3] = np.nan
+    return slope, intercept, r2
+
+
+class Analyzer(object):
+    def __init__(self, max_leak_rate=5e-3, slow_factor=2.0, min_r2=0.9, max_gap=5.0,
+                 min_points=5, base_pressure=0.0, pump_mask=PUMP_MASK, source_mask=SOURCE_MASK):
+        # max_leak_rate: pressure units/s, max_gap: seconds, min_points:
+        # windows with fewer samples are not checked for slow or poor fits,
+        # base_pressure: ultimate pressure of the pump, see window_stats
+        self.max_leak_rate = max_leak_rate
+        self.slow_factor = slow_factor
+        self.min_r2 = min_r2
+        self.max_gap = max_gap
+        self.min_points = min_points
+        self.base_pressure = base_pressure
+        self.pump_mask = pump_mask
+        self.source_mask = source_mask
+        self._done = []
+        self._open = None
+
+    def feed(self, records):
+        # records: time ordered array with time, pressure and valves fields,
+        # e.g. a slice of PressureLog.records
+        if not len(records):
+            return
+        continues = self._open is not None and records['valves'][0] == self._open['valves'][0]
+        stats = window_stats(records, self._open['start'][0] if continues else None, self.base_pressure)
+        if continues:
+            first = _take(stats, slice(0, 1))
+            merged = self._open
+            gap = records['time'][0] - merged['end'][0]
+            for key in ('count', 'lin', 'log'):
+                merged[key] = merged[key] + first[key]
+            merged['max_gap'] = np.maximum(np.maximum(merged['max_gap'], first['max_gap']), gap)
+            merged['end'] = first['end']
+            merged['p_last'] = first['p_last']
+            stats = _take(stats, slice(1, None))
+            if len(stats['start']):
+                self._done.append(merged)
+                self._open = None
+            else:
+                return
+        elif self._open is not None:
+            self._done.append(self._open)
+        self._done.append(_take(stats, slice(0, -1)))
+        self._open = _take(stats, slice(-1, None))
+
+    def feed_rows(self, rows):
+        # live data, (timestamp, pressure, valves) tuples
+        self.feed(rows_to_records(rows))
+
+    def finish(self):
+        # close the window still open, e.g. at the end of a log
+        if self._open is not None:
+            self._done.append(self._open)
+            self._open = None
+
+    def current(self):
+        # results for the window still open, None before any data
+        if self._open is None:
+            return None
+        return self._results(self._open)
+
+    def results(self):
+        # results for every completed window, a dict of arrays:
+        # start, end, valves, kind, count, pressure_start, pressure_end,
+        # leak_rate and leak_r2 (ISOLATED windows), tau and pump_r2 (PUMPING
+        # windows), max_gap and flags
+        stats = _join(self._done)
+        self._done = [stats]
+        return self._results(stats)
+
+    def _results(self, stats):
+        valves = stats['valves']
+        kind = np.where(valves & self.source_mask, DOSING,
+                        np.where(valves & self.pump_mask, PUMPING, ISOLATED))
+        slope, _, leak_r2 = line_fit(stats['lin'])
+        log_slope, _, pump_r2 = line_fit(stats['log'])
+        leak_rate = np.where(kind == ISOLATED, slope, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tau = np.where((kind == PUMPING) & (log_slope < 0), -1.0 / log_slope, np.nan)
+        fitted = stats['count'] >= self.min_points
+        flags = np.zeros(len(valves), dtype=np.uint32)
+        with np.errstate(invalid='ignore'):
+            flags[leak_rate > self.max_leak_rate] |= HIGH_LEAK
+            if np.any(fitted & ~np.isnan(tau)):
+                median = np.nanmedian(tau[fitted])
+                flags[fitted & (tau > self.slow_factor * median)] |= SLOW_PUMP
+            r2 = np.where(kind == ISOLATED, leak_r2, np.where(kind == PUMPING, pump_r2, np.nan))
+            flags[fitted & (r2 < self.min_r2)] |= POOR_FIT
+            flags[stats['max_gap'] > self.max_gap] |= GAP
+        return {
+            'start': stats['start'],
+            'end': stats['end'],
+            'valves': valves,
+            'kind': kind,
+            'count': stats['count'],
+            'pressure_start': stats['p_first'],
+            'pressure_end': stats['p_last'],
+            'leak_rate': leak_rate,
+            'leak_r2': np.where(kind == ISOLATED, leak_r2, np.nan),
+            'tau': tau,
+            'pump_r2': np.where(kind == PUMPING, pump_r2, np.nan),
+            'max_gap': stats['max_gap'],
+            'flags': flags,
+        }
+
+
+def analyze(records, chunk_size=1 << 20, **params):
+    # analyse a whole log (e.g. LogArchive.records() or PressureLog.records)
+    # chunk by chunk, params as for Analyzer
+    analyzer = Analyzer(**params)
+    for i in range(0, len(records), chunk_size):
+        analyzer.feed(records[i:i + chunk_size])
+    analyzer.finish()
+    return analyzer.results()
+
+
+if __name__ == '__main__':
+    import argparse
+    from pressure_log import LogArchive
+    parser = argparse.ArgumentParser(description='leak rates and pump-down time constants of a pressure log')
+    parser.add_argument('prefix', nargs='?', default='pressure_log_', help='path the log files start with')
+    parser.add_argument('-start', help='time.time() to start from', type=float)
+    parser.add_argument('-end', help='time.time() to end at', type=float)
+    parser.add_argument('-base', help='ultimate pressure of the pump, default 0', type=float, default=0.0)
+    parser.add_argument('-anomalies', help='only print flagged windows', action='store_true')
+    args = parser.parse_args()
+    result = analyze(LogArchive(args.prefix).records(args.start, args.end), base_pressure=args.base)
+    kinds = ('isolated', 'pumping', 'dosing')
+    for i in range(len(result['start'])):
+        if args.anomalies and not result['flags'][i]:
+            continue
+        if result['kind'][i] == ISOLATED:
+            fit = 'leak {:.3e}/s r2 {:.3f}'.format(result['leak_rate'][i], result['leak_r2'][i])
+        elif result['kind'][i] == PUMPING:
+            fit = 'tau {:.2f} s r2 {:.3f}'.format(result['tau'][i], result['pump_r2'][i])
+        else:
+            fit = ''
+        print('{:.1f} {:8.1f} s {:8} {:.3e} -> {:.3e} {} {}'.format(
+            result['start'][i], result['end'][i] - result['start'][i], kinds[result['kind'][i]],
+            result['pressure_start'][i], result['pressure_end'][i], fit,
+            ', '.join(describe_flags(result['flags'][i]))))
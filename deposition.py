@@ -0,0 +1,255 @@
+# Event driven deposition sequence.
+#
+# The controller runs a compiled recipe (see recipe.py) from its own thread.
+# The thread sleeps on a condition variable until a sample is posted or a
+# timer is due, so it uses no CPU while waiting and acts on a sample as soon
+# as it arrives. Valve pulses and phase dwell times are timers on that same
+# thread instead of sleeps, samples keep being handled while a valve is open.
+# Phases dosing to a target pressure have their pulses planned by a
+# dosing.DoseScheduler, which learns from every pulse how far it moved the
+# pressure.
+#
+#   valves = {'water': WATER, 'fdts': FDTS, 'isolation': ISOLATION}
+#   controller = DepositionController(load_recipe('recipes/fdts.json', valves), set_valve)
+#   controller.start()
+#   controller.post_pressure(time.time(), pressure)  # from the gauge thread
+#   controller.post_temperatures(readings)           # from the thermometer thread
+#   ...
+#   controller.stats['max_latency']
+#
+# Pressures are in the gauge's unit (torr), times in seconds.
+
+import heapq
+import operator
+import threading
+import time
+
+from dosing import DoseScheduler
+from ds18b20 import GOOD
+from trend import PressureTrend
+
+
+class DepositionController(object):
+    def __init__(self, recipe, set_valve, clock=time.monotonic, speed=1.0, dosing=None):
+        # recipe: compiled Recipe, set_valve: callable(valve, level) driving
+        # a valve open (True) or closed (False), clock: seconds the recipe's
+        # times are measured in, running speed times faster than real time
+        # (e.g. a sim.SimClock's monotonic and speed), dosing: DoseScheduler
+        # to plan dosing pulses with, e.g. one loaded with earlier runs
+        self.recipe = recipe
+        self.set_valve = set_valve
+        self.clock = clock
+        self.speed = speed
+        self.dosing = dosing if dosing is not None else DoseScheduler()
+        # latency: seconds from a pressure being posted to the decision on it,
+        # dropped: samples replaced by a newer one before they were handled
+        self.stats = {'samples': 0, 'dropped': 0, 'last_latency': 0.0,
+                      'max_latency': 0.0, 'mean_latency': 0.0}
+        self.pressure = None
+        self.temperatures = []
+        # smoothed pressure the conditions use when the recipe has a filter
+        self.trend = PressureTrend(**recipe.filter) if recipe.filter is not None else None
+        self._phase = recipe.start
+        self._entered = None
+        self._generation = 0
+        self._taken = [0] * recipe.transition_count
+        self._sample = None
+        self._new_temperatures = False
+        self._timers = []
+        self._seq = 0
+        self._pulsing = set()
+        self._settling = set()  # valves whose dosing pulse has not settled yet
+        self._settled = []      # dosing pulses waiting for a sample after settling
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.finished = threading.Event()
+
+    @property
+    def phase(self):
+        # name of the current phase
+        return self.recipe.phases[self._phase].name
+
+    def post_pressure(self, timestamp, pressure):
+        # hand a new sample to the controller, only the newest one is kept
+        with self._cond:
+            if self._sample is not None:
+                self.stats['dropped'] += 1
+            # the trend is timed by the controller's monotonic clock, a wall
+            # clock timestamp can step (NTP) and would show up as a slope
+            self._sample = (timestamp, pressure, time.monotonic(), self.clock())
+            self._cond.notify()
+
+    def post_temperatures(self, readings):
+        # readings: ds18b20 Readings, by sensor index
+        with self._cond:
+            self.temperatures = readings
+            self._new_temperatures = True
+            self._cond.notify()
+
+    def schedule(self, delay, callback, *args):
+        # run callback(*args) on the controller thread delay seconds from now
+        with self._cond:
+            heapq.heappush(self._timers, (self.clock() + delay, self._seq, callback, args))
+            self._seq += 1
+            self._cond.notify()
+
+    def start(self):
+        self._running = True
+        self._enter(self.recipe.start, self.clock())
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        # returns once the thread is done, valves still open for a pulse are closed
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self.join()
+        self._end_pulses()
+
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _next_events(self):
+        # wait for a sample or due timers, None once stopped
+        with self._cond:
+            while self._running:
+                now = self.clock()
+                due = []
+                while self._timers and self._timers[0][0] <= now:
+                    due.append(heapq.heappop(self._timers))
+                if due or self._sample is not None or self._new_temperatures:
+                    sample, self._sample = self._sample, None
+                    self._new_temperatures = False
+                    return sample, due
+                self._cond.wait((self._timers[0][0] - now) / self.speed if self._timers else None)
+            return None
+
+    def _run(self):
+        while not self.finished.is_set():
+            events = self._next_events()
+            if events is None:
+                return
+            sample, due = events
+            for _, _, callback, args in due:
+                callback(*args)
+            if not self.finished.is_set():
+                if sample is not None:
+                    self.pressure = sample[1]
+                    if self.trend is not None:
+                        self.trend.update(sample[3], sample[1])
+                    if self._settled:
+                        self._record_doses()
+                self._evaluate(self.clock())
+                if sample is not None:
+                    self._record_latency(time.monotonic() - sample[2])
+        self._end_pulses()
+
+    def _record_latency(self, latency):
+        stats = self.stats
+        stats['samples'] += 1
+        stats['last_latency'] = latency
+        stats['max_latency'] = max(stats['max_latency'], latency)
+        stats['mean_latency'] += (latency - stats['mean_latency']) / stats['samples']
+
+    def _holds(self, conditions, lead=None):
+        trend = self.trend
+        for field, op, threshold, sensor in conditions:
+            if field == 'pressure':
+                if trend is None:
+                    value = self.pressure
+                else:
+                    value = trend.pressure()
+                    if lead is not None and value is not None and not op(value, threshold):
+                        # heading for the threshold fast enough counts as
+                        # there, as does a level already past it
+                        if trend.time_to(threshold, op is operator.lt) <= lead:
+                            continue
+            else:
+                value = None
+                if sensor < len(self.temperatures) and self.temperatures[sensor].quality == GOOD:
+                    value = self.temperatures[sensor].value
+            if value is None or not op(value, threshold):
+                return False
+        return True
+
+    def _evaluate(self, now):
+        # take the first transition of the current phase that applies
+        phase = self.recipe.phases[self._phase]
+        elapsed = now - self._entered
+        for t in phase.transitions:
+            if t.after is not None and elapsed < t.after:
+                continue
+            if t.times is not None and self._taken[t.number] >= t.times:
+                continue
+            if self._holds(t.conditions, t.lead):
+                self._taken[t.number] += 1
+                for kind, valve, seconds in t.actions:
+                    if kind == 'pulse':
+                        self._pulse(valve, seconds)
+                    else:
+                        self.set_valve(valve, kind == 'open')
+                self._enter(t.next, now)
+                return
+        dose = phase.pulse
+        if dose is not None and dose.valve not in self._pulsing and dose.valve not in self._settling:
+            self._dose(dose, now)
+
+    def _enter(self, index, now):
+        self._phase = index
+        self._entered = now
+        self._generation += 1
+        phase = self.recipe.phases[index]
+        if not phase.transitions:
+            self.finished.set()
+            return
+        # dwell-only transitions need no sample to be taken
+        for dwell in phase.dwells:
+            self.schedule(dwell, self._dwell_over, self._generation)
+
+    def _dwell_over(self, generation):
+        if generation == self._generation:
+            self._evaluate(self.clock())
+
+    def _pulse(self, valve, seconds):
+        # open valve now and close it again from a timer
+        self._pulsing.add(valve)
+        self.set_valve(valve, True)
+        self.schedule(seconds, self._end_pulse, valve)
+
+    def _dose(self, dose, now):
+        if dose.target is None:
+            self._pulse(dose.valve, dose.seconds)
+            return
+        if self.pressure is None:
+            return
+        seconds, _ = self.dosing.plan(dose.valve, self.pressure, dose.target,
+                                      dose.seconds, dose.max_seconds, dose.min_seconds)
+        if not seconds:
+            # on target, the transitions take it from here
+            return
+        self._settling.add(dose.valve)
+        self._pulse(dose.valve, seconds)
+        self.schedule(seconds + dose.settle, self._dose_settled, dose.valve, now, seconds, self.pressure)
+
+    def _dose_settled(self, valve, started, seconds, before):
+        # the pressure so far may be from before the pulse, wait for a new sample
+        self._settled.append((valve, started, seconds, before))
+
+    def _record_doses(self):
+        for valve, started, seconds, before in self._settled:
+            self.dosing.record(valve, started, seconds, before, self.pressure)
+            self._settling.discard(valve)
+        self._settled = []
+
+    def _end_pulse(self, valve):
+        if valve in self._pulsing:
+            self.set_valve(valve, False)
+            self._pulsing.discard(valve)
+
+    def _end_pulses(self):
+        for valve in list(self._pulsing):
+            self._end_pulse(valve)
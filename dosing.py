@@ -0,0 +1,123 @@
+# Predictive valve pulses for dosing a chamber to a pressure.
+#
+# Pulsing a source valve with a fixed width until the pressure passes a
+# threshold overshoots by up to a whole pulse and wastes precursor. A
+# DoseScheduler learns for every valve how much the pressure rises per second
+# it is open, from the pulses it has seen, and plans the fewest pulses no
+# longer than max_seconds that add up to the rise still needed. Only the
+# first of them is given, the plan is redone once its pressure has settled.
+#
+#   scheduler = DoseScheduler()
+#   seconds, count = scheduler.plan(valve, pressure, target, 0.1, 1.0, 0.02)
+#   ... open valve for seconds, wait for the pressure to settle ...
+#   scheduler.record(valve, started, seconds, pressure, settled_pressure)
+#   scheduler.history         # Pulses, oldest first
+#   scheduler.save('pressure_log_dosing.json')
+#
+# The model of a valve is rise = gain * (seconds - dead_time), a least squares
+# line over its pulses with older ones weighted down by forget, so it follows
+# the gain dropping as the chamber fills. With pulses of a single width it
+# is a line through the origin. A plan is a few float operations, the fit is
+# updated when a pulse is recorded.
+
+import json
+import math
+import time
+from collections import deque, namedtuple
+
+# time: clock time the valve opened, before/after: pressure before the pulse
+# and once settled, None when there was no reading
+Pulse = namedtuple('Pulse', ['time', 'valve', 'seconds', 'before', 'after'])
+
+
+class ValveModel(object):
+    def __init__(self, forget=0.7):
+        self.forget = forget
+        # weighted sums of 1, seconds, rise, seconds*seconds, seconds*rise
+        self.sums = [0.0] * 5
+        self.pulses = 0
+        self.gain = None     # pressure rise per open second, None until learnt
+        self.dead_time = 0.0
+
+    def add(self, seconds, rise):
+        for i, value in enumerate((1.0, seconds, rise, seconds * seconds, seconds * rise)):
+            self.sums[i] = self.sums[i] * self.forget + value
+        self.pulses += 1
+        self._fit()
+
+    def _fit(self):
+        n, sw, sr, sww, swr = self.sums
+        vww = sww - sw * sw / n
+        if vww > 1e-6 * sww:
+            gain = (swr - sw * sr / n) / vww
+            if gain > 0:
+                dead_time = (sw - sr / gain) / n
+                if dead_time >= 0:
+                    self.gain, self.dead_time = gain, dead_time
+                    return
+        gain = swr / sww if sww > 0 else 0.0
+        self.gain, self.dead_time = (gain, 0.0) if gain > 0 else (None, 0.0)
+
+
+class DoseScheduler(object):
+    def __init__(self, forget=0.7, history=10000):
+        # forget: weight of a pulse in the fit relative to the next one,
+        # history: number of pulses kept
+        self.forget = forget
+        self.models = {}   # valve -> ValveModel
+        self.history = deque(maxlen=history)
+        # plan_time: seconds taken deciding on a pulse
+        self.stats = {'plans': 0, 'last_plan_time': 0.0, 'max_plan_time': 0.0}
+
+    def plan(self, valve, pressure, target, seconds, max_seconds, min_seconds=0.0):
+        # (width of the next pulse, pulses planned to reach target), (0.0, 0)
+        # once there or when the pulse needed is under min_seconds; until the
+        # valve's gain is learnt the next pulse is a probe of seconds and the
+        # count is None
+        started = time.monotonic()
+        need = target - pressure
+        model = self.models.get(valve)
+        if need <= 0:
+            width, count = 0.0, 0
+        elif model is None or model.gain is None:
+            width, count = min(seconds, max_seconds), None
+        else:
+            per_pulse = model.gain * (max_seconds - model.dead_time)
+            count = max(1, int(math.ceil(need / per_pulse))) if per_pulse > 0 else 1
+            width = need / (count * model.gain) + model.dead_time
+            width = min(max_seconds, width)
+            if width < min_seconds:
+                width, count = 0.0, 0
+        elapsed = time.monotonic() - started
+        self.stats['plans'] += 1
+        self.stats['last_plan_time'] = elapsed
+        self.stats['max_plan_time'] = max(self.stats['max_plan_time'], elapsed)
+        return width, count
+
+    def record(self, valve, started, seconds, before, after):
+        # a pulse that has settled, it goes into the history and the valve's model
+        self.history.append(Pulse(started, valve, seconds, before, after))
+        if before is None or after is None or seconds <= 0:
+            return
+        model = self.models.get(valve)
+        if model is None:
+            model = self.models[valve] = ValveModel(self.forget)
+        model.add(seconds, after - before)
+
+    def save(self, path):
+        # models and history as JSON, to start the next run already learnt
+        with open(path, 'w') as f:
+            json.dump({
+                'models': [[valve, model.sums, model.pulses] for valve, model in self.models.items()],
+                'history': list(self.history),
+            }, f)
+
+    def load(self, path):
+        with open(path) as f:
+            state = json.load(f)
+        for valve, sums, pulses in state['models']:
+            model = self.models[valve] = ValveModel(self.forget)
+            model.sums = list(sums)
+            model.pulses = pulses
+            model._fit()
+        self.history.extend(Pulse(*pulse) for pulse in state['history'])
@@ -6,7 +6,30 @@
 
 import os
 import glob
+import subprocess
+import threading
 import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+W1_DEVICES_DIR = '/sys/bus/w1/devices/'
+
+# quality of a Reading
+GOOD = 'good'
+STALE = 'stale'
+FAILED = 'failed'
+
+# value: degrees C or None, timestamp: time.time() the value was read,
+# age: seconds since then, quality: GOOD, STALE or FAILED
+Reading = namedtuple('Reading', ['value', 'timestamp', 'age', 'quality'])
+
+def format_reading(reading):
+	# text for the log and LCD, stale values get a ? and failed ones --
+	if reading.quality == FAILED:
+		return '--'
+	if reading.quality == STALE:
+		return '{}?'.format(reading.value)
+	return '{}'.format(reading.value)
 
 class DS18B20:
 	# much of this code is lifted from Adafruit web site
@@ -24,43 +47,115 @@ class DS18B20:
 	# You can connect more than one sensor to the same set of pins
 	# Only one pullup resistor is required
 	
-	def __init__(self):
-		# load required kernel modules
-		os.system('modprobe w1-gpio')
-		os.system('modprobe w1-therm')
+	def __init__(self, base_dir = W1_DEVICES_DIR, rescan_interval = 10):
+		# load required kernel modules, skipped when they are already loaded
+		if base_dir == W1_DEVICES_DIR:
+			for module in ('w1_gpio', 'w1_therm'):
+				if not os.path.isdir('/sys/module/' + module):
+					try:
+						subprocess.call(['modprobe', module.replace('_', '-')])
+					except OSError:
+						pass
+		
+		self._base_dir = base_dir
+		# sensors are indexed in the order they were first seen, so a probe
+		# keeps its index (and log column) when others are added or removed
+		self._rom_ids = list()
+		# ROM ID -> open file descriptor of its w1_slave, None while unplugged
+		self._handles = dict()
+		self._lock = threading.Lock()
+		self._rescan(sort = True)
 		
-		# Find file names for the sensor(s)
-		base_dir = '/sys/bus/w1/devices/'
-		device_folder = glob.glob(base_dir + '28*')
-		self._num_devices = len(device_folder)
-		self._device_file = list()
-		i = 0
-		while i < self._num_devices:
-			self._device_file.append(device_folder[i] + '/w1_slave')
-			i += 1
+		# bus masters whose kernel driver can start a conversion on every
+		# sensor at once, see read_all
+		self._bulk_read_files = glob.glob(base_dir + 'w1_bus_master*/therm_bulk_read')
+		self._pool = None
+		self._pool_size = 0
+		
+		# per sensor (value, time.time(), time.monotonic(), last read ok),
+		# filled by the sampler thread, see start_sampling
+		self._latest = list()
+		self._stale_after = None
+		# passes the sampler has finished, notified on _sampled after each
+		self._sample_seq = 0
+		self._sampled = threading.Condition()
+		self._sampler = None
+		
+		# look for hot-plugged sensors in the background
+		self._stop = threading.Event()
+		if rescan_interval:
+			t = threading.Thread(target = self._rescan_loop, args = (rescan_interval,))
+			t.daemon = True
+			t.start()
+		
+	def _rescan(self, sort = False):
+		# open handles for new sensors and close those of removed ones
+		found = [os.path.basename(path) for path in glob.glob(self._base_dir + '28*')]
+		if sort:
+			found.sort()
+		with self._lock:
+			for rom_id in found:
+				if rom_id not in self._handles:
+					self._rom_ids.append(rom_id)
+					self._handles[rom_id] = None
+				if self._handles[rom_id] is None:
+					try:
+						self._handles[rom_id] = os.open(self._base_dir + rom_id + '/w1_slave', os.O_RDONLY)
+					except OSError:
+						pass
+			for rom_id in self._rom_ids:
+				if rom_id not in found and self._handles[rom_id] is not None:
+					os.close(self._handles[rom_id])
+					self._handles[rom_id] = None
+		
+	def _rescan_loop(self, interval):
+		while not self._stop.wait(interval):
+			self._rescan()
+			
+	def close(self):
+		self._stop.set()
+		with self._lock:
+			for rom_id, fd in self._handles.items():
+				if fd is not None:
+					os.close(fd)
+				self._handles[rom_id] = None
+		
+	def rom_ids(self):
+		# ROM IDs (e.g. 28-0316a2794aff) in sensor index order
+		return list(self._rom_ids)
 		
 	def _read_temp(self,index):
-		# Issue one read to one sensor
+		# Issue one read to one sensor, None if it is not connected
 		# you should not call this directly
-		f = open(self._device_file[index],'r')
-		lines = f.readlines()
-		f.close()
-		return lines
+		rom_id = self._rom_ids[index]
+		fd = self._handles[rom_id]
+		if fd is None:
+			return None
+		try:
+			# reading the open sysfs file from offset 0 runs a new conversion
+			data = os.pread(fd, 256, 0)
+		except OSError:
+			# unplugged since the last rescan
+			with self._lock:
+				if self._handles[rom_id] == fd:
+					os.close(fd)
+					self._handles[rom_id] = None
+			return None
+		return data.decode(errors = 'replace').splitlines()
 		
-	def tempC(self,index = 0):
+	def tempC(self,index = 0, retries = 5):
 		# call this to get the temperature in degrees C
-		# detected by a sensor
+		# detected by a sensor, None if the sensor could not be read
 		lines = self._read_temp(index)
-		retries = 5
-		while (lines[0].strip()[-3:] != 'YES') and (retries > 0):
+		while lines and (lines[0].strip()[-3:] != 'YES') and (retries > 0):
 			# read failed so try again
 			time.sleep(0.1)
 			#print('Read Failed', retries)
 			lines = self._read_temp(index)
 			retries -= 1
 			
-		if retries == 0:
-			return 998
+		if not lines or lines[0].strip()[-3:] != 'YES' or len(lines) < 2:
+			return None
 			
 		equals_pos = lines[1].find('t=')
 		if equals_pos != -1:
@@ -68,8 +163,114 @@ class DS18B20:
 			return float(temp)/1000
 		else:
 			# error
-			return 999
+			return None
+			
+	def read_all(self, retries = 5):
+		# call this to get the temperature of every sensor in one go
+		# returns (time.time() of the read, [temperature in degrees C or None, ...])
+		# a conversion takes about 750 ms, so rather than one sensor after
+		# the other all sensors convert at the same time: through the bus
+		# master's bulk convert trigger if the kernel has it, otherwise by
+		# reading each w1_slave file from its own thread
+		count = len(self._rom_ids)
+		if count == 0:
+			return (time.time(), [])
+		if self._bulk_read_files and self._bulk_convert():
+			temps = [self.tempC(i, retries) for i in range(count)]
+		else:
+			if self._pool_size < count:
+				if self._pool is not None:
+					self._pool.shutdown(wait = False)
+				self._pool = ThreadPoolExecutor(max_workers = count)
+				self._pool_size = count
+			temps = list(self._pool.map(self.tempC, range(count), [retries] * count))
+		return (time.time(), temps)
+		
+	def start_sampling(self, interval = 1.0, stale_after = 5.0):
+		# keep reading every sensor in the background so latest() never
+		# blocks, a reading older than stale_after seconds is marked stale
+		if self._sampler is not None:
+			raise RuntimeError('already sampling')
+		self._stale_after = stale_after
+		self._sampler = threading.Thread(target = self._sample_loop, args = (interval,))
+		self._sampler.daemon = True
+		self._sampler.start()
+		
+	def _sample_loop(self, interval):
+		while not self._stop.is_set():
+			started = time.monotonic()
+			# no retries, a failed read is simply retried on the next pass
+			timestamp, temps = self.read_all(retries = 0)
+			now = time.monotonic()
+			latest = self._latest
+			while len(latest) < len(temps):
+				latest.append((None, None, None, False))
+			for i, temp in enumerate(temps):
+				if temp is None:
+					# keep the last good value, flag that the read failed
+					value, wall, mono, _ = latest[i]
+					latest[i] = (value, wall, mono, False)
+				else:
+					latest[i] = (temp, timestamp, now, True)
+			with self._sampled:
+				self._sample_seq += 1
+				self._sampled.notify_all()
+			self._stop.wait(max(0, interval - (now - started)))
 			
+	def latest(self, index = 0):
+		# last good reading of a sensor as a Reading, never blocks
+		# quality is GOOD for a fresh value, STALE when the value is older
+		# than stale_after or the last read of the sensor failed, FAILED
+		# when there has never been a good value (value is then None)
+		try:
+			value, wall, mono, ok = self._latest[index]
+		except IndexError:
+			return Reading(None, None, None, FAILED)
+		if value is None:
+			return Reading(None, None, None, FAILED)
+		age = time.monotonic() - mono
+		if ok and age <= self._stale_after:
+			return Reading(value, wall, age, GOOD)
+		return Reading(value, wall, age, STALE)
+		
+	def latest_all(self):
+		return [self.latest(i) for i in range(len(self._rom_ids))]
+		
+	def wait_for_sample(self, seq = None, timeout = None):
+		# block until the sampler finishes a pass after pass number seq,
+		# returns the number of the latest pass
+		if self._sampler is None:
+			raise RuntimeError('start_sampling() has not been called')
+		with self._sampled:
+			if seq is None:
+				seq = self._sample_seq
+			self._sampled.wait_for(lambda: self._sample_seq > seq, timeout)
+			return self._sample_seq
+		
+	def _bulk_convert(self, timeout=1.5):
+		# start a conversion on every sensor and wait for it to finish,
+		# afterwards each w1_slave read returns the converted value at once
+		try:
+			for path in self._bulk_read_files:
+				with open(path, 'w') as f:
+					f.write('trigger')
+			deadline = time.time() + timeout
+			for path in self._bulk_read_files:
+				while True:
+					with open(path) as f:
+						# -1 while a conversion is running
+						if f.read().strip() != '-1':
+							break
+					if time.time() > deadline:
+						return False
+					time.sleep(0.05)
+		except (IOError, OSError):
+			# no permission or an older kernel, fall back to threads
+			self._bulk_read_files = []
+			return False
+		return True
+		
 	def device_count(self):
-		# call this to see how many sensors have been detected
-		return self._num_devices
+		# call this to see how many sensors have been detected, including
+		# ones unplugged since, their index stays reserved
+		return len(self._rom_ids)
@@ -0,0 +1,126 @@
+# Software stand-in for RPi.GPIO, for running the LCD driver and valve code
+# on a machine without GPIO hardware.
+#
+#   import lcd
+#   from gpio_stub import StubGPIO
+#   lcd.use_backend(StubGPIO())
+#
+# Pin levels are kept in memory and every output() call is counted. Pins
+# wired to an HD44780 in 4-bit mode can be decoded back into the text the
+# display would show, see StubGPIO.attach_lcd.
+
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+HIGH = 1
+LOW = 0
+
+
+class StubHD44780(object):
+    # decodes HD44780 transfers on D4-D7 into DDRAM contents. Like a display
+    # after power on it starts in 8-bit mode, where every nibble is an
+    # instruction, until a function set switches it to 4-bit mode.
+    def __init__(self, rs, e, data_pins):
+        self.rs = rs
+        self.e = e
+        self.data_pins = data_pins
+        self.ddram = {}
+        self.address = 0x00
+        self.four_bit = False
+        self._high = None
+
+    def clock(self, levels):
+        # called on the falling edge of E
+        nibble = 0
+        for bit, pin in enumerate(self.data_pins):
+            if levels.get(pin):
+                nibble |= 1 << bit
+        if not self.four_bit:
+            # D0-D3 are not wired, only a function set to 4-bit matters here
+            if nibble == 0x2:
+                self.four_bit = True
+            return
+        if self._high is None:
+            self._high = nibble
+            return
+        byte = (self._high << 4) | nibble
+        self._high = None
+        if levels.get(self.rs):
+            self.ddram[self.address] = byte
+            self.address += 1
+        elif byte == 0x01:
+            self.ddram.clear()
+            self.address = 0x00
+        elif byte & 0x80:
+            self.address = byte & 0x7F
+
+    def line(self, address, chars=16):
+        return ''.join(chr(self.ddram.get(address + i, 0x20)) for i in range(chars))
+
+
+class StubGPIO(object):
+    BCM = BCM
+    BOARD = BOARD
+    OUT = OUT
+    IN = IN
+    HIGH = HIGH
+    LOW = LOW
+
+    def __init__(self):
+        self.levels = {}
+        self.modes = {}
+        self.writes = 0  # output() calls
+        self.listeners = []  # callables(pin, level) run on every pin change
+        self.lcd = None
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, channel, direction, initial=None):
+        for pin in _channels(channel):
+            self.modes[pin] = direction
+            if initial is not None:
+                self.levels[pin] = bool(initial)
+
+    def input(self, channel):
+        return int(bool(self.levels.get(channel)))
+
+    def output(self, channel, value):
+        # same forms as RPi.GPIO: one pin and value, or lists of each
+        self.writes += 1
+        pins = _channels(channel)
+        if isinstance(value, (list, tuple)):
+            values = value
+        else:
+            values = [value] * len(pins)
+        for pin, level in zip(pins, values):
+            level = bool(level)
+            if self.lcd is not None and pin == self.lcd.e and self.levels.get(pin) and not level:
+                self.lcd.clock(self.levels)
+            self.levels[pin] = level
+            for listener in self.listeners:
+                listener(pin, level)
+
+    def cleanup(self, channel=None):
+        if channel is None:
+            self.levels.clear()
+            self.modes.clear()
+        else:
+            for pin in _channels(channel):
+                self.levels.pop(pin, None)
+                self.modes.pop(pin, None)
+
+    def attach_lcd(self, rs, e, data_pins):
+        # decode writes to an HD44780 wired to these pins, see self.lcd.line()
+        self.lcd = StubHD44780(rs, e, data_pins)
+        return self.lcd
+
+
+def _channels(channel):
+    if isinstance(channel, (list, tuple)):
+        return list(channel)
+    return [channel]
@@ -21,8 +21,17 @@
 # 15: LCD Backlight +5V
 # 16: LCD Backlight GND
 
-import RPi.GPIO as GPIO
+import threading
 import time
+try:
+  import RPi.GPIO as GPIO
+  _gpio_error = None
+except (ImportError, RuntimeError) as e:
+  # not on a Pi, or not allowed to use its GPIO: no backend until
+  # use_backend() is given one, e.g. a gpio_stub.StubGPIO, so a hardware
+  # run fails loudly instead of silently driving nothing
+  GPIO = None
+  _gpio_error = e
 
 # GPIO to LCD mapping
 LCD_RS = 27 # Pi pin 13
@@ -31,15 +40,44 @@ LCD_D4 = 25 # Pi pin 22
 LCD_D5 = 24 # Pi pin 18
 LCD_D6 = 23 # Pi pin 16
 LCD_D7 = 22 # Pi pin 15
+LCD_DATA = [LCD_D4, LCD_D5, LCD_D6, LCD_D7]
+LCD_RS_DATA = [LCD_RS] + LCD_DATA
 # Device constants
 LCD_CHR = True # Character mode
 LCD_CMD = False # Command mode
 LCD_CHARS = 16 # Characters per line (16 max)
 LCD_LINE_1 = 0x80 # LCD memory location for 1st line
 LCD_LINE_2 = 0xC0 # LCD memory location 2nd line
+LCD_CLEAR = 0x01 # Clear display command
+
+# Timing, HD44780 datasheet minimums with a little margin
+E_PULSE = 0.0000005 # Enable pulse width, 450 ns minimum
+E_DELAY = 0.00004 # Most commands and data writes take 37 us
+CLEAR_DELAY = 0.0016 # Clear display and return home take 1.52 ms
+POWER_ON_DELAY = 0.05 # 40 ms from power on before the first instruction
+INIT_DELAY = 0.0045 # 4.1 ms after the first 8-bit function set nibble
+INIT_SHORT_DELAY = 0.00015 # 100 us after the second one
+
+# Shadow of what the display shows, DDRAM address -> character code,
+# None where unknown. lcd_text only sends the cells that differ.
+_shadow = {}
+_cursor = None # DDRAM address the next data write goes to, None if unknown
+
+# D4-D7 levels for every nibble value, so a nibble goes out in one call
+NIBBLES = [[bool(n & 0x01), bool(n & 0x02), bool(n & 0x04), bool(n & 0x08)] for n in range(16)]
+
+def use_backend(gpio):
+  # drive the display through another RPi.GPIO compatible object,
+  # e.g. gpio_stub.StubGPIO() for benchmarks and tests without hardware
+  global GPIO
+  GPIO = gpio
+  lcd_invalidate()
 
 # Define main program cod
 def setup_gpio(): 
+  if GPIO is None:
+    raise RuntimeError('RPi.GPIO is not available ({}), call use_backend() with a '
+                       'gpio_stub.StubGPIO to run without hardware'.format(_gpio_error))
   GPIO.setwarnings(False)
   GPIO.setmode(GPIO.BCM) # Use BCM GPIO numbers
   GPIO.setup(LCD_E, GPIO.OUT) # Set GPIO's to output mode
@@ -66,60 +104,147 @@ def test_loop():
 
 # Initialize and clear display
 def lcd_init():
-  lcd_write(0x33,LCD_CMD) # Initialize
-  lcd_write(0x32,LCD_CMD) # Set to 4-bit mode
-  lcd_write(0x06,LCD_CMD) # Cursor move direction
-  lcd_write(0x0C,LCD_CMD) # Turn cursor off
+  # Initialization by instruction, the display starts in 8-bit mode where
+  # every nibble is an instruction of its own and needs its own delay
+  time.sleep(POWER_ON_DELAY)
+  lcd_write_nibble(0x3) # Function set, 8-bit
+  _wait(INIT_DELAY)
+  lcd_write_nibble(0x3)
+  _wait(INIT_SHORT_DELAY)
+  lcd_write_nibble(0x3)
+  _wait(E_DELAY)
+  lcd_write_nibble(0x2) # Set to 4-bit mode
+  _wait(E_DELAY)
   lcd_write(0x28,LCD_CMD) # 2 line display
-  lcd_write(0x01,LCD_CMD) # Clear display
-  time.sleep(0.0005) # Delay to allow commands to process
+  lcd_write(0x0C,LCD_CMD) # Turn cursor off
+  lcd_write(LCD_CLEAR,LCD_CMD) # Clear display
+  lcd_write(0x06,LCD_CMD) # Cursor move direction
+
+def _wait(seconds):
+  # time.sleep cannot do microseconds, spin for the short HD44780 delays
+  end = time.perf_counter() + seconds
+  while time.perf_counter() < end:
+    pass
+
+def _track(bits, mode):
+  # follow what a write does to the display for lcd_text's shadow copy
+  global _cursor
+  if mode == LCD_CHR:
+    if _cursor is not None:
+      _shadow[_cursor] = bits
+      _cursor += 1
+  elif bits == LCD_CLEAR:
+    for line in (LCD_LINE_1, LCD_LINE_2):
+      for i in range(LCD_CHARS):
+        _shadow[line + i] = 0x20
+    _cursor = LCD_LINE_1
+  elif bits & 0x80:
+    # set DDRAM address
+    _cursor = bits
+  elif bits == 0x02:
+    # return home
+    _cursor = LCD_LINE_1
 
 def lcd_write(bits, mode):
-  # High bits
-  GPIO.output(LCD_RS, mode) # RS
-  GPIO.output(LCD_D4, False)
-  GPIO.output(LCD_D5, False)
-  GPIO.output(LCD_D6, False)
-  GPIO.output(LCD_D7, False)
-  if bits&0x10==0x10:
-    GPIO.output(LCD_D4, True)
-  if bits&0x20==0x20:
-    GPIO.output(LCD_D5, True)
-  if bits&0x40==0x40:
-    GPIO.output(LCD_D6, True)
-  if bits&0x80==0x80:
-    GPIO.output(LCD_D7, True)
+  # High bits, set together with RS in one call
+  GPIO.output(LCD_RS_DATA, [mode] + NIBBLES[bits >> 4])
   # Toggle 'Enable' pin
   lcd_toggle_enable()
   # Low bits
-  GPIO.output(LCD_D4, False)
-  GPIO.output(LCD_D5, False)
-  GPIO.output(LCD_D6, False)
-  GPIO.output(LCD_D7, False)
-  if bits&0x01==0x01:
-    GPIO.output(LCD_D4, True)
-  if bits&0x02==0x02:
-    GPIO.output(LCD_D5, True)
-  if bits&0x04==0x04:
-    GPIO.output(LCD_D6, True)
-  if bits&0x08==0x08:
-    GPIO.output(LCD_D7, True)
+  GPIO.output(LCD_DATA, NIBBLES[bits & 0x0F])
   # Toggle 'Enable' pin
   lcd_toggle_enable()
+  # Let the controller execute the byte
+  if mode == LCD_CMD and bits in (LCD_CLEAR, 0x02):
+    _wait(CLEAR_DELAY)
+  else:
+    _wait(E_DELAY)
+  _track(bits, mode)
+
+def lcd_write_nibble(nibble):
+  # One command nibble on D4-D7, only during initialisation
+  GPIO.output(LCD_RS_DATA, [LCD_CMD] + NIBBLES[nibble])
+  lcd_toggle_enable()
 
 def lcd_toggle_enable():
-  time.sleep(0.0005)
   GPIO.output(LCD_E, True)
-  time.sleep(0.0005)
+  _wait(E_PULSE)
   GPIO.output(LCD_E, False)
-  time.sleep(0.0005)
 
 def lcd_text(message,line):
-  # Send text to display
+  # Send text to display, only the characters that differ from what the
+  # display already shows are written
   message = message.ljust(LCD_CHARS," ")
-  lcd_write(line, LCD_CMD)
   for i in range(LCD_CHARS):
-    lcd_write(ord(message[i]),LCD_CHR)
+    address = line + i
+    char = ord(message[i])
+    if _shadow.get(address) == char:
+      continue
+    if _cursor != address:
+      lcd_write(address, LCD_CMD)
+    lcd_write(char, LCD_CHR)
+
+def lcd_invalidate():
+  # forget the shadow copy, e.g. after the display lost power, so the next
+  # lcd_text calls redraw every character
+  global _cursor
+  _shadow.clear()
+  _cursor = None
+
+class LCDRenderer(object):
+  # Draws the display from its own thread so callers never wait on it.
+  # set_line only stores the text, the thread redraws at most max_fps times
+  # a second with whatever text is newest, skipping values that were
+  # replaced before they could be shown.
+  LINES = (LCD_LINE_1, LCD_LINE_2)
+
+  def __init__(self, max_fps=10):
+    self.period = 1.0 / max_fps
+    self._text = [None] * len(self.LINES) # newest text per line
+    self._drawn = [None] * len(self.LINES) # text on the display
+    self._cond = threading.Condition()
+    self._running = False
+    self._thread = None
+
+  def set_line(self, n, text):
+    # n: display line, 1 or 2
+    with self._cond:
+      self._text[n - 1] = text
+      self._cond.notify()
+
+  def start(self):
+    self._running = True
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    # returns once the thread is done, the caller can then use the display
+    with self._cond:
+      self._running = False
+      self._cond.notify()
+    if self._thread:
+      self._thread.join()
+
+  def _changed(self):
+    return self._text != self._drawn
+
+  def _run(self):
+    while True:
+      with self._cond:
+        self._cond.wait_for(lambda: not self._running or self._changed())
+        if not self._running:
+          return
+        text = list(self._text)
+      started = time.monotonic()
+      for i, line in enumerate(self.LINES):
+        if text[i] is not None and text[i] != self._drawn[i]:
+          lcd_text(text[i], line)
+          self._drawn[i] = text[i]
+      # cap the frame rate, changes made meanwhile are drawn next frame
+      remaining = self.period - (time.monotonic() - started)
+      if remaining > 0:
+        time.sleep(remaining)
 
 
 if __name__=="__main__":
@@ -1,193 +1,219 @@
+import argparse
 import os
-import RPi.GPIO as GPIO
-from threading import Thread, Event, Timer
-from queue import Queue
+import tempfile
+from threading import Thread
 import time
 import lcd
-from mks_901p import Mks901P
-from ds18b20 import DS18B20
-
-vac_interface = Mks901P('/dev/ttyUSB0')
-pressure_unit = ' {}'.format(vac_interface.get_pressure_unit())
-print(pressure_unit)
-lcd.setup_gpio()
-thermal_interface = DS18B20()
-thermometer_count = thermal_interface.device_count()
-file_prefix = 'pressure_log_'
-num_prev_files = len([item for item in os.listdir('.') if item.startswith(file_prefix)])
-logfile = open(file_prefix+str(num_prev_files), 'w', buffering=128)
-logfile.write(pressure_unit+'\n')
-
+from mks_901p import Mks901P, Mks901PError, format_pressure
+from ds18b20 import DS18B20, format_reading
+from pressure_log import RotatingLogWriter, LogCommitter, LogWriteError, temperature_values
+from deposition import DepositionController
+from dosing import DoseScheduler
+from recipe import load_recipe
+from sample_bus import SampleBus
 
 # use P1 header pin numbering convention
-GPIO.setmode(GPIO.BCM) #BOARD)
 WATER = LEFT = 10 #orange wire, leftmost
 FDTS = MIDDLE = 9 #yellow wire, middle
 ISOLATION = RIGHT = 11  #brown wire, rightmost from powersupply
-GPIO.setup(LEFT, GPIO.OUT)
-GPIO.setup(MIDDLE, GPIO.OUT)
-GPIO.setup(RIGHT, GPIO.OUT)
-
-# Input from pin 11
-#input_value = GPIO.input(11)
-
-
-vac_msg = Queue()
-therm_msg = Queue()
-lcd_msg = Queue()
-log_msg = Queue()
-emergency_stop = False
-
-
-def read_vac():
-    while not emergency_stop:
-        pressure = vac_interface.get_pressure_combined_4_digit()
-        if not pressure:
-            continue
-        pressure = '{}'.format()
-        pressure_float = float(pressure)
-        pressure_string = '{}{}'.format(pressure, pressure_unit)
-        vac_msg.put((pressure_float, pressure_string))
-
-
-def read_therms():
-    while not emergency_stop:
-        temp_list = [thermal_interface.tempC(i) for i in range(thermometer_count)]
-        if not all(temp_list):
-            continue
-        temp_list = [str(t) for t in temp_list]
-        temp_string = ' '.join(temp_list)
-        therm_msg.put(temp_list, temp_string)
-
-def update_LCD():
-    while not emergency_stop:
-        if lcd_msg.qsize() > 0:
-            pressure_string, temperature_string = lcd_msg.get()
-            lcd.lcd_text(pressure_string, lcd.LCD_LINE_1)
-            lcd.lcd_text(temperature_string, lcd.LCD_LINE_2)
-
-def update_log():
-    while not emergency_stop:
-        if log_msg.qsize() > 0:
-            pressure_string, temperature_string = lcd_msg.get()
-            logfile.write('{} {}\n'.format(pressure_string, temperature_string))
-
-
-phase0_target_pressure = 0.3 # torr
-phase1_target_pressure = 5   # torr
-phase2_start=False           # doesn't start immediately, there's a delay for reaction to proceed
-phase2_start_delay=60        # seconds
-phase3_target_pressure = 1   # torr
-phase3_degas_done = False    # first opening of FDTS valve will "burp" the air
-phase4_fdts_target_pressure = 5
-reaction_cycles = 0
-max_reaction_cycles = 2
-
-def set_phase2_start():
-    phase2_start=True
-
-def set_phase5_start():
-    phase5_start=True
-
-def run_deposition():
-    phase=0
-    while not emergency_stop:
-        vac = None
-        therm = None
-        while vac is None or therm is None:
-            if vac_msg.qsize() > 0:
-                vac = vac_msg.get()
-            if therm_msg.qsize() > 0:
-                therm = therm_msg.get()
-        pressure_float, pressure_string = vac
-        temperature_list, temperature_string = therm
-        lcd_msg.put(pressure_string, temperature_string)
-        log_msg.put(pressure_string, temperature_string)
-        print('Phase: {}'.format(phase))
-        if phase==0:
-            # wait til vacuum gets to 0.3 torr (3*10^1)
-            if pressure_float < phase0_target_pressure:
-                # stop pumping the chamber
-                GPIO.output(ISOLATION, GPIO.LOW)
-                phase=1
-        elif phase==1:
-            # pulse WATER til it increases to at least 5 torr
-            GPIO.output(WATER, GPIO.HIGH)
-            time.sleep(0.1)
-            GPIO.output(WATER, GPIO.LOW)
-            if pressure_float>phase1_target_pressure:
-                Timer(phase2_start_delay, set_phase2_start).start()
-                phase=2
-        elif phase==2:
-            #wait X minutes for surface adsorption before restarting pumpdown
-            if phase2_start:
-                phase2_start=False
-                GPIO.output(ISOLATION, GPIO.HIGH)
-                phase = 3
-        elif phase==3:
-            # wait til vacuum gets to 1 torr
-            if pressure_float<phase3_target_pressure:
-                if phase3_degas_done:
-                    # stop pumping the chamber
-                    GPIO.output(ISOLATION, GPIO.LOW)
-                    phase3_degas_done = False
-                    phase=4
-                else:
-                    #degas
-                    GPIO.output(FDTS, GPIO.HIGH)
-                    time.sleep(0.1)
-                    GPIO.output(FDTS, GPIO.LOW)
-                    phase3_degas_done = True
-        elif phase==4:
-            # pulse FDTS til it increases to at least 5 torr
-            GPIO.output(FDTS, GPIO.HIGH)
-            time.sleep(1)
-            GPIO.output(FDTS, GPIO.LOW)
-            if pressure_float > phase4_fdts_target_pressure:
-                Timer(phase5_start_delay, set_phase5_start).start()
-                phase=5
-        elif phase==5:
-            #wait X minutes for FDTS to react before restarting pumpdown
-            if phase5_start:
-                phase5_start=False
-                reaction_cycles+=1
-                if reaction_cycles>=max_reaction_cycles:
-                    break
-                else:
-                    GPIO.output(ISOLATION, GPIO.HIGH)
-                    phase = 0
-        #time.sleep(0.1)
-
-print("Starting all deposition support threads")
-
-t1 = Thread(target=read_vac)
-t2 = Thread(target=read_therms)
-t3 = Thread(target=run_deposition)
-t4 = Thread(target=update_LCD)
-t5 = Thread(target=update_log)
-threads = [t1, t2, t3, t4, t5]
-
-t1.start()
-t2.start()
-t3.start()
-t4.start()
-t5.start()
-
-# open the isolation valve between the rough pump and the chamber
-GPIO.output(ISOLATION, GPIO.HIGH)
-
-try:
-    for tloop in threads:
-        tloop.join()
-except KeyboardInterrupt:
-    pass 
-finally:
-    GPIO.output(WATER, GPIO.LOW)
-    GPIO.output(FDTS, GPIO.LOW)
-    GPIO.output(ISOLATION, GPIO.LOW)
-    emergency_stop = True
-    lcd.lcd_write(0x01, lcd.LCD_CMD)
-    lcd.lcd_text("Vacuum System Stopped!", lcd.LCD_LINE_1)
-    GPIO.cleanup()
-
-print("End of Vacuum System Control Code")
+# bit of each valve in the log's valve mask
+valve_bits = {WATER: 1, FDTS: 2, ISOLATION: 4}
+valves = {'water': WATER, 'fdts': FDTS, 'isolation': ISOLATION}
+
+vac_error_delay = 0.5  # seconds to wait after a failed pressure read
+reader_join_timeout = 5.0  # seconds a reader thread gets to notice a stop
+# the standard FDTS process, see recipe.py for the format
+default_recipe = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recipes', 'fdts.json')
+
+
+class VacuumSystem(object):
+    def __init__(self, gpio, vac_interface, thermal_interface, recipe_file,
+                 file_prefix='pressure_log_', clock=time, speed=1.0, dosing_file=None):
+        # gpio: RPi.GPIO or a gpio_stub.StubGPIO, drives the valves and the LCD
+        # clock: the time module, or a sim.SimClock running speed times faster
+        # dosing_file: where what dosing learns is kept between runs, None to
+        # start from scratch and keep nothing
+        self.gpio = gpio
+        self.vac_interface = vac_interface
+        self.thermal_interface = thermal_interface
+        self.clock = clock
+        self.emergency_stop = False
+        self.readers = []  # the pressure and temperature reading threads
+        self.valve_state = 0
+        self.pressure_unit = ' {}'.format(vac_interface.get_pressure_unit())
+        print(self.pressure_unit)
+        lcd.use_backend(gpio)
+        lcd.setup_gpio()
+        self.lcd_renderer = lcd.LCDRenderer()
+        thermal_interface.start_sampling()
+        self.logfile = RotatingLogWriter(file_prefix, self.pressure_unit.strip(),
+                                         thermal_interface.rom_ids(), buffering=0)
+        self.log_writer = LogCommitter(self.logfile)
+        self.log_failed = False
+        gpio.setmode(gpio.BCM) #BOARD)
+        gpio.setup(LEFT, gpio.OUT)
+        gpio.setup(MIDDLE, gpio.OUT)
+        gpio.setup(RIGHT, gpio.OUT)
+        # Input from pin 11
+        #input_value = GPIO.input(11)
+        self.dosing_file = dosing_file
+        self.dosing = DoseScheduler()
+        if dosing_file is not None and os.path.exists(dosing_file):
+            self.dosing.load(self.dosing_file)
+        self.controller = DepositionController(load_recipe(recipe_file, valves), self.set_valve,
+                                               clock.monotonic, speed, self.dosing)
+        # readers publish, control, display and log each take what they need
+        self.bus = SampleBus(clock)
+        self.bus.subscribe('pressure', self.show_pressure)
+        self.bus.subscribe('pressure', self.log_pressure)
+        self.bus.subscribe('pressure', lambda sample: self.controller.post_pressure(sample.timestamp, sample.value))
+        self.bus.subscribe('temperatures', self.show_temperatures)
+        self.bus.subscribe('temperatures', lambda sample: self.controller.post_temperatures(sample.value))
+
+    def set_valve(self, valve, level):
+        self.gpio.output(valve, level)
+        if level:
+            self.valve_state |= valve_bits[valve]
+        else:
+            self.valve_state &= ~valve_bits[valve]
+
+    def read_vac(self):
+        while not self.emergency_stop:
+            try:
+                pressure_float = self.vac_interface.get_pressure_combined_4_digit()
+            except Mks901PError:
+                # the gauge already retried, give a noisy bus a moment to settle
+                time.sleep(vac_error_delay)
+                continue
+            self.bus.publish('pressure', pressure_float)
+            print('Phase: {}'.format(self.controller.phase))
+
+    def read_therms(self):
+        sample = None
+        while not self.emergency_stop:
+            # readings carry their own quality, failed or stale sensors are
+            # passed on marked as such rather than dropped or faked
+            sample = self.thermal_interface.wait_for_sample(sample, timeout=1)
+            self.bus.publish('temperatures', self.thermal_interface.latest_all())
+
+    def show_pressure(self, sample):
+        self.lcd_renderer.set_line(1, '{}{}'.format(format_pressure(sample.value), self.pressure_unit))
+
+    def show_temperatures(self, sample):
+        self.lcd_renderer.set_line(2, ' '.join([format_reading(t) for t in sample.value]))
+
+    def log_pressure(self, sample):
+        # a record per pressure, with the newest temperatures and valve states
+        temperatures = self.bus.latest('temperatures')
+        temps = temperature_values(temperatures.value) if temperatures else ()
+        if self.log_failed:
+            return
+        try:
+            self.log_writer.put(sample.timestamp, sample.value, temps, self.valve_state)
+        except LogWriteError as e:
+            # report it once, the run goes on without a log rather than stop
+            # the pressure readings the controller depends on
+            self.log_failed = True
+            print(e)
+
+    def run(self):
+        # run the recipe, returns once it is done or interrupted and every
+        # thread has been stopped
+        print("Starting all deposition support threads")
+        self.readers = [Thread(target=self.read_vac), Thread(target=self.read_therms)]
+        for t in self.readers:
+            t.daemon = True
+
+        self.lcd_renderer.start()
+        self.log_writer.start()
+        self.controller.start()
+        for t in self.readers:
+            t.start()
+
+        # open the isolation valve between the rough pump and the chamber
+        self.set_valve(ISOLATION, self.gpio.HIGH)
+
+        try:
+            # waits with a timeout so Ctrl-C gets through
+            while not self.controller.finished.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        self.controller.stop()
+        self.set_valve(WATER, self.gpio.LOW)
+        self.set_valve(FDTS, self.gpio.LOW)
+        self.set_valve(ISOLATION, self.gpio.LOW)
+        self.emergency_stop = True
+        # nothing is published once the readers are gone
+        for t in self.readers:
+            t.join(reader_join_timeout)
+        self.thermal_interface.close()
+        self.lcd_renderer.stop()
+        lcd.lcd_write(0x01, lcd.LCD_CMD)
+        lcd.lcd_text("Vacuum System Stopped!", lcd.LCD_LINE_1)
+        self.gpio.cleanup()
+        try:
+            self.log_writer.stop()
+        except LogWriteError as e:
+            if not self.log_failed:
+                print(e)
+        finally:
+            self.logfile.close()
+        if self.dosing_file is not None:
+            self.dosing.save(self.dosing_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a deposition recipe on the vacuum system.')
+    parser.add_argument('recipe', nargs='?', default=default_recipe,
+                        help='recipe file, defaults to recipes/fdts.json')
+    parser.add_argument('--port', default='/dev/ttyUSB0', help='serial port of the 901P')
+    parser.add_argument('--sim', action='store_true',
+                        help='run against the simulated chamber of sim.py instead of the hardware')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='with --sim, how many times faster than real time the chamber runs')
+    parser.add_argument('--log_prefix', help='path the log files start with, default pressure_log_, '
+                        'with --sim in a new temporary directory')
+    parser.add_argument('--dosing_file', help='where dosing keeps what it learnt about the valves, default '
+                        '<log_prefix>dosing.json, with --sim nothing is kept unless given')
+    args = parser.parse_args(argv)
+
+    if args.sim:
+        from sim import Simulation
+        # simulated records and valve gains must not end up with the hardware's
+        if args.log_prefix is None:
+            args.log_prefix = os.path.join(tempfile.mkdtemp(prefix='vacuum_sim_'), 'pressure_log_')
+            print('Logging to {}'.format(args.log_prefix))
+        sim = Simulation(ISOLATION, WATER, FDTS, speed=args.speed)
+        sim.start()
+        started = time.monotonic()
+        try:
+            system = VacuumSystem(sim.gpio, Mks901P(sim.port), DS18B20(base_dir=sim.w1_dir),
+                                  args.recipe, args.log_prefix, sim.clock, args.speed, args.dosing_file)
+            system.run()
+        finally:
+            sim.stop()
+        print('Recipe took {:.1f} s simulated, {:.1f} s real'.format(
+            sim.clock.monotonic(), time.monotonic() - started))
+        print('Controller: {}'.format(system.controller.stats))
+        print('Dosing: {}'.format(system.dosing.stats))
+    else:
+        # the valves have to move: no fallback to a stub, fail if RPi.GPIO does
+        import RPi.GPIO as GPIO
+        if args.log_prefix is None:
+            args.log_prefix = 'pressure_log_'
+        if args.dosing_file is None:
+            args.dosing_file = args.log_prefix + 'dosing.json'
+        system = VacuumSystem(GPIO, Mks901P(args.port), DS18B20(), args.recipe, args.log_prefix,
+                              dosing_file=args.dosing_file)
+        system.run()
+
+    print("End of Vacuum System Control Code")
+
+
+if __name__ == '__main__':
+    main()
@@ -286,7 +286,7 @@ commands = {
             'Response':    '@xxxACK10;FF', 
             'Explanation': 'Set analog voltage output 1 calibration.'},
         'set_analog_out_2': {
-            'Command':     '@{}AO1!10;FF', 
+            'Command':     '@{}AO2!10;FF', 
             'Response':    '@xxxACK10;FF', 
             'Explanation': 'Set analog voltage output 2 calibration.'}
     },
@@ -317,6 +317,11 @@ error_responses = [
     ['180',      'Not in setup mode (locked)',                 '-'],
 ]
 
+# flat view of the commands table, command key -> {'Command', 'Response', ...}
+command_lookup = {}
+for _group in commands.values():
+    command_lookup.update(_group)
+
 
 # xxx = Transducer communication address (001 to 253. Broadcast addresses: 254, 255)
 broadcast_address_1 = 254  # 254 WILL cause any listening sensors to reply
@@ -324,87 +329,670 @@ broadcast_address_2 = 255  # 255 will NOT cause any listening sensors to reply
 
 DEBUG = False
 
+import json
+import os
+import re
+import time
 import serial
+
+FRAME_START = b'@'
+FRAME_END = b';FF'
+# longest a single read on the port blocks, replies are read in a loop that
+# keeps each request's deadline itself, so the port settings never change
+# per request (every change is a tcsetattr)
+READ_POLL = 0.01
+
+
+class Mks901PError(Exception):
+    pass
+
+class Mks901PTimeout(Mks901PError):
+    # no valid reply within the call's deadline and retries
+    pass
+
+class Mks901PNak(Mks901PError):
+    # the transducer answered NAK, code and error come from error_responses
+    code = None
+
+    def __init__(self, code, command=None):
+        self.code = code
+        self.error = nak_messages.get(code, 'Unknown NAK code')
+        self.command = command
+        super(Mks901PNak, self).__init__('NAK{} {} ({})'.format(code, self.error, command))
+
+class ZeroAdjustmentError(Mks901PNak):
+    pass
+
+class AtmosphereAdjustmentError(Mks901PNak):
+    pass
+
+class UnrecognizedMessage(Mks901PNak):
+    pass
+
+class InvalidArgument(Mks901PNak):
+    pass
+
+class ValueOutOfRange(Mks901PNak):
+    pass
+
+class InvalidCommandCharacter(Mks901PNak):
+    pass
+
+class NotInSetupMode(Mks901PNak):
+    pass
+
+nak_messages = dict((int(row[0]), row[1]) for row in error_responses[1:])
+nak_exceptions = {
+    8: ZeroAdjustmentError,
+    9: AtmosphereAdjustmentError,
+    160: UnrecognizedMessage,
+    169: InvalidArgument,
+    172: ValueOutOfRange,
+    175: InvalidCommandCharacter,
+    180: NotInSetupMode,
+}
+
+def nak_error(code, command=None):
+    # typed exception for a NAK code
+    return nak_exceptions.get(code, Mks901PNak)(code, command)
+
+# NAKs worth repeating, a frame garbled by line noise comes back unrecognized
+RETRY_NAK_CODES = (160,)
+
+class RetryPolicy(object):
+    # retries: extra attempts after a timeout, garbled reply or retryable NAK
+    # backoff: wait before the first retry, doubled for each further one up
+    #          to max_backoff
+    # budget: seconds one call may take including retries, None for no limit
+    def __init__(self, retries=2, backoff=0.02, max_backoff=0.5, budget=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+
+    def delay(self, attempt):
+        return min(self.backoff * 2 ** attempt, self.max_backoff)
+
+    def budget_end(self, now):
+        # clock time a call started at now has to be done by, None for no limit
+        if self.budget is None:
+            return None
+        return now + self.budget
+
+    def wait_after(self, error, attempt, now, budget_end):
+        # seconds to wait before repeating a failed attempt (counting from 0),
+        # raises error when it is not worth repeating or retries or budget
+        # are used up. Shared by Mks901P and AsyncMks901P, which do the waiting
+        if isinstance(error, Mks901PNak) and error.code not in RETRY_NAK_CODES:
+            raise error
+        delay = self.delay(attempt)
+        if attempt >= self.retries or (budget_end is not None and now + delay >= budget_end):
+            raise error
+        return delay
+
+NO_RETRY = RetryPolicy(retries=0)
+
+def check_reply(reply, frame, address, stats):
+    # pop_reply's tuple (None on timeout) for a request frame sent to address,
+    # return: None for a good ACK, otherwise the exception describing it,
+    # timeouts and NAKs are counted in the stats dict
+    if reply is None:
+        stats['timeouts'] += 1
+        return Mks901PTimeout('no reply to {}'.format(frame))
+    if address < broadcast_address_1 and reply[0] != address:
+        return Mks901PError('reply from address {} to {}'.format(reply[0], frame))
+    if not reply[1]:
+        stats['naks'] += 1
+        try:
+            return nak_error(int(reply[2]), frame)
+        except ValueError:
+            return Mks901PError('garbled NAK {} to {}'.format(reply[2], frame))
+    return None
+
+# last known good baud rate per serial port, see Mks901P.detect_baud
+BAUD_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.mks_901p_baud.json')
+
+def _deadline(timeout, budget_end):
+    # monotonic time an attempt ends, timeout from now but within budget_end
+    deadline = time.monotonic() + timeout
+    if budget_end is not None and budget_end < deadline:
+        return budget_end
+    return deadline
+
+def _load_baud_cache(cache_file):
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def _save_baud_cache(cache_file, cache):
+    try:
+        with open(cache_file, 'w') as f:
+            json.dump(cache, f)
+    except IOError:
+        if DEBUG:
+            print('could not write baud rate cache {}'.format(cache_file))
+
+# @<3 digit address><ACK|NAK><value>;FF, matched straight on the receive buffer
+REPLY_RE = re.compile(rb'@(\d{3})(ACK|NAK)([^;@]*);FF')
+
+def pop_reply(buf):
+    # remove the first complete reply frame from the bytearray buf and return
+    # ((int) address, (bool) ack, (bytes) value), None if no frame has arrived yet
+    while True:
+        m = REPLY_RE.search(buf)
+        if m is None:
+            end = buf.find(FRAME_END)
+            if end == -1:
+                return None
+            # terminator without a valid frame in front of it, garbage on the line
+            del buf[:end+len(FRAME_END)]
+            continue
+        reply = (int(m.group(1)), m.group(2) == b'ACK', m.group(3))
+        del buf[:m.end()]
+        return reply
+
+def command_method_name(key):
+    # name of the client method for a commands key, pressure readings are
+    # exposed as get_pressure_<key> like get_pressure_combined_4_digit
+    if key in commands['Pressure reading']:
+        return 'get_pressure_' + key
+    return key
+
+def format_address(address):
+    # transducer addresses always go on the wire as 3 digits, e.g. 1 -> '001'
+    return '{:03d}'.format(int(address))
+
+def e_notation(value, digits):
+    # the transducer's float notation, single digit exponents e.g. 1.234E-3
+    mantissa, exponent = '{:.{}E}'.format(float(value), digits).split('E')
+    return '{}E{}{}'.format(mantissa, exponent[0], int(exponent[1:]))
+
+def format_pressure(pressure):
+    # 4 digit reading back to the transducer's own notation, e.g. 1.234E-3
+    if pressure is None:
+        return '-'
+    return e_notation(pressure, 3)
+
+FLOAT_VALUE_RE = re.compile(r'^[-+]?\d\.\d+E[-+]\d+$')
+INT_VALUE_KEYS = ('get_baud_rate', 'get_address', 'get_time_on', 'set_baud_rate', 'set_address')
+ON_OFF_VALUES = ('ON', 'OFF')
+
+def _to_str(value):
+    return value.decode()
+
+def _to_bool(value):
+    # setpoint relay status, SET=energized / CLEAR=deenergized
+    return value == b'SET'
+
+def _on_to_bool(value):
+    return value == b'ON'
+
+def _format_float(value):
+    return e_notation(value, 2)
+
+def _format_on_off(value):
+    if isinstance(value, str):
+        value = value.upper()
+        if value not in ON_OFF_VALUES:
+            raise ValueError('expected ON or OFF, got {}'.format(value))
+        return value
+    return 'ON' if value else 'OFF'
+
+def _format_baud(value):
+    if int(value) not in baud_supported:
+        raise ValueError('unsupported baud rate {}'.format(value))
+    return str(int(value))
+
+def _format_upper(value):
+    return str(value).upper()
+
+class CompiledCommand(object):
+    # one commands table entry with its frame pre-encoded per address, the
+    # formatter for the value a set command sends and the converter that
+    # turns the reply value into a python type
+    __slots__ = ('key', 'prefix', 'body', 'suffix', 'takes_value', 'default_value',
+                 'format_value', 'convert', '_frames')
+
+    def __init__(self, key, entry):
+        self.key = key
+        prefix, tail = entry['Command'].split('{}')
+        tail = tail[:-len(FRAME_END)]
+        self.prefix = prefix.encode()
+        self.suffix = FRAME_END
+        sample = entry['Response'][len('@xxxACK'):-len(FRAME_END)]
+        # set commands are OP!value, the value in the table is only an example
+        # except for the perform_ adjustments where it is the usual reference
+        self.takes_value = '!' in tail
+        self.default_value = None
+        if self.takes_value:
+            op, value = tail.split('!', 1)
+            tail = op + '!'
+            if key.startswith('perform_'):
+                self.default_value = value
+        else:
+            value = ''
+        self.body = tail.encode()
+        if FLOAT_VALUE_RE.match(value):
+            self.format_value = _format_float
+        elif value in ON_OFF_VALUES:
+            self.format_value = _format_on_off
+        elif key == 'set_address':
+            self.format_value = format_address
+        elif key == 'set_baud_rate':
+            self.format_value = _format_baud
+        elif key == 'set_user_tag':
+            self.format_value = str
+        else:
+            self.format_value = _format_upper
+        if key.startswith('get_setpoint_') and key.endswith('_status'):
+            self.convert = _to_bool
+        elif FLOAT_VALUE_RE.match(sample):
+            self.convert = float
+        elif key in INT_VALUE_KEYS:
+            self.convert = int
+        elif sample in ON_OFF_VALUES:
+            self.convert = _on_to_bool
+        else:
+            self.convert = _to_str
+        self._frames = {}
+        if not self.takes_value or self.default_value is not None:
+            for address in (broadcast_address_1, broadcast_address_2):
+                self.frame(address)
+
+    def frame(self, address, value=None):
+        # frames without a value are built on first use for each address and kept
+        if value is not None:
+            value = self.format_value(value).encode()
+            return self.prefix + format_address(address).encode() + self.body + value + self.suffix
+        try:
+            return self._frames[address]
+        except KeyError:
+            if self.takes_value and self.default_value is None:
+                raise ValueError('{} needs a value'.format(self.key))
+            value = (self.default_value or '').encode()
+            frame = self._frames[address] = self.prefix + format_address(address).encode() + self.body + value + self.suffix
+            return frame
+
+compiled_commands = dict((key, CompiledCommand(key, entry)) for key, entry in command_lookup.items())
+# everything Mks901P.read_config reads back
+config_keys = [key for key in command_lookup if key.startswith('get_')]
+
 class Mks901P(object):
-    def __init__(self, com_port_name, baud=9600):
+    def __init__(self, com_port_name, baud=9600, timeout=1, retry=None):
         self.com_port_name = com_port_name
         if DEBUG:
             print('creating new MKS 901p object with baud of {}'.format(baud))
-        self.serial_port = serial.Serial(com_port_name, baudrate=baud, timeout=1)
+        # timeout is the default per-attempt deadline, a reply normally
+        # completes well before it since reads stop at the ;FF terminator
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy()
+        # late_replies: replies to timed out requests dropped before the next one
+        self.stats = dict.fromkeys(('requests', 'retries', 'timeouts', 'naks', 'late_replies'), 0)
+        # errors of the entries that failed in the last batch call
+        self.last_errors = {}
+        self.serial_port = serial.Serial(com_port_name, baudrate=baud, timeout=READ_POLL)
         #self.serial_port.read()
         self.pressure_unit = None
+        # receive buffer reused for every reply
+        self._rx = bytearray()
+        # replies to timed out broadcast requests that may still be on their way
+        self._late = 0
+
+    @classmethod
+    def find_baud(cls, com_port_name, cache_file=None):
+        # return: None or ((str) sensor ID, (int) baud_rate)
+        m = cls(com_port_name)
+        try:
+            return m.detect_baud(cache_file=cache_file)
+        finally:
+            m.serial_port.close()
 
     @classmethod
-    def baud_rate(cls):
-        # return: None or ((str) sensor ID, (str) baud_rate)
-        from subprocess import STDOUT, check_output, TimeoutExpired
-        for baud in baud_supported:
-            print("attempting to ask MKS 901p for it's baudrate using baudrate of {}".format(baud))
-            cmd = [sys.executable, this_files_path, com_port, '--find_baud', '--baud={}'.format(baud)]
+    def baud_rate(cls, com_port_name):
+        baud = cls.find_baud(com_port_name)
+        if baud:
+            print('sensor ({}) replied with baudrate of ({})'.format(baud[0], baud[1]))
+        return baud
+
+    def detect_baud(self, timeout=0.1, cache_file=None):
+        # return: None or ((str) sensor ID, (int) baud_rate)
+        # Switches this object's open port through the supported baud rates,
+        # trying the last rate that worked on this port first and then the
+        # factory default, and stops at the first valid ACK. The port is left
+        # at the detected rate and the rate is cached for the next start.
+        if cache_file is None:
+            cache_file = BAUD_CACHE_FILE
+        cache = _load_baud_cache(cache_file)
+        candidates = [cache.get(self.com_port_name), 9600] + baud_supported
+        cmd = commands['Communication information']['get_baud_rate']
+        tried = set()
+        for baud in candidates:
+            if baud is None or baud in tried:
+                continue
+            tried.add(baud)
+            if DEBUG:
+                print("attempting to ask MKS 901p for it's baudrate using baudrate of {}".format(baud))
+            self.serial_port.baudrate = baud
+            # a late reply at the previous rate is only noise at this one and
+            # goes with the input buffer, no need to wait for it
+            self._late = 0
             try:
-                output = check_output(cmd, stderr=STDOUT, timeout=1)
-                if output:
-                    output = output.decode().split(',')
-                    output = [o.strip("() '\n") for o in output]
-                    print('sensor ({}) replied with baudrate of ({})'.format(output[0], output[1]))
-                    return (output[0], output[1])
-            except TimeoutExpired:
-                pass
+                output = self.send_cmd(cmd['Command'], cmd['Response'], broadcast_address_1,
+                                       timeout=timeout, retry=NO_RETRY)
+            except Mks901PError:
+                continue
+            if output[1] == str(baud):
+                if cache.get(self.com_port_name) != baud:
+                    cache[self.com_port_name] = baud
+                    _save_baud_cache(cache_file, cache)
+                return (output[0], baud)
+        return None
 
     def get_pressure_unit(self, address=broadcast_address_1):
-        cmd = commands['Calibration and adjustment information']['get_pressure_unit']
-        expect = cmd['Response']
-        cmd = cmd['Command']
-        output = self.send_cmd(cmd, expect, address)
-        if output:
-            self.pressure_unit = output[1]
+        unit = self.query('get_pressure_unit', address)
+        if unit:
+            self.pressure_unit = unit
             return self.pressure_unit
 
     def get_pressure_combined_4_digit(self, address=broadcast_address_1, return_address=False):
-        cmd = commands['Pressure reading']['combined_4_digit']['Command']
-        expect = commands['Pressure reading']['combined_4_digit']['Response']
-        output = self.send_cmd(cmd, expect, address)
-        if output and not return_address:
-            return output[1]
-        return output
-
-    def send_cmd(self, cmd, expected_response, address):
-        cmd = cmd.format(address)
+        return self.query('combined_4_digit', address, return_address=return_address)
+
+    def query(self, key, address=broadcast_address_1, timeout=None, return_address=False, value=None, retry=None):
+        # send the commands entry key and return its typed reply value (float
+        # for pressures, bool for setpoint status, ...)
+        # value: what a set command writes, formatted for the wire from python types
+        # return_address: return ((int) address, value) instead
+        # retry: RetryPolicy for this call instead of self.retry
+        # raises Mks901PTimeout when no reply arrives, a Mks901PNak subclass
+        # when the transducer rejects the command
         if not self.serial_port:
             return('no connection')
-        self.serial_port.write(bytes(cmd.encode()))
-        raw_data = self.serial_port.read(len(expected_response))
-        data = raw_data.decode()
-        if 'ACK' in data:
-            addr = data[data.index('@')+len('@'):data.index('ACK')]
-            value = data[data.index('ACK')+len('ACK'):].split(';')[0]
-            return (addr,value)
-        else:
+        cmd = compiled_commands[key]
+        reply = self._transact(cmd.frame(address, value), address, timeout, retry)
+        try:
+            value = cmd.convert(reply[2])
+        except ValueError:
+            raise Mks901PError('unexpected value {} for {}'.format(reply[2], key))
+        if return_address:
+            return (reply[0], value)
+        return value
+
+    def send_cmd(self, cmd, expected_response, address, timeout=None, retry=None):
+        # send a raw command template, return: ((str) address, (str) value)
+        # expected_response is only kept for the call signature, the reply
+        # length is taken from the ;FF terminator instead of the sample string
+        # raises like query()
+        if not self.serial_port:
+            return('no connection')
+        frame = cmd.format(format_address(address)).encode()
+        reply = self._transact(frame, address, timeout, retry)
+        return (format_address(reply[0]), reply[2].decode())
+
+    def query_many(self, queries, address=broadcast_address_1, timeout=None, pipeline=False):
+        # queries: list of command keys from commands (e.g. 'pirani', 'get_status')
+        #          or (address, command key) tuples to mix transducers on one bus
+        # return: dict mapping each query to its typed reply value, None for
+        #         the ones that failed, their exceptions are in self.last_errors
+        # All frames are encoded up front and each one goes out as soon as the
+        # previous reply's terminator arrives. With pipeline=True every frame is
+        # written in a single burst, only use that on a full duplex (RS-232)
+        # link, on half duplex RS-485 the replies would collide with requests.
+        requests = []
+        for query in queries:
+            if isinstance(query, tuple):
+                addr, key = query
+            else:
+                addr, key = address, query
+            cmd = compiled_commands[key]
+            requests.append((query, addr, cmd, cmd.frame(addr)))
+        return self._transact_many(requests, timeout, pipeline)
+
+    def configure(self, settings, address=broadcast_address_1, timeout=None):
+        # settings: dict of set command key -> value, e.g. {'set_setpoint_1': 20.0,
+        #           'enable_setpoint_1': True}, written back to back like query_many
+        # return: dict of key -> value the transducer acknowledged, None if it
+        #         failed, see self.last_errors
+        requests = []
+        for key, value in settings.items():
+            cmd = compiled_commands[key]
+            requests.append((key, address, cmd, cmd.frame(address, value)))
+        return self._transact_many(requests, timeout, False)
+
+    def read_config(self, address=broadcast_address_1, timeout=None):
+        # every get_ command in one batch, return: dict of key -> typed value
+        return self.query_many(config_keys, address, timeout)
+
+    def stream(self, key='combined_4_digit', period=0, address=broadcast_address_1,
+               timeout=None, retry=NO_RETRY):
+        # poll key back to back, or once every period seconds, and yield
+        # (time.monotonic() of the reply, value) per poll, value is None when
+        # the poll failed. Periods are kept on a monotonic schedule so the
+        # time a poll takes does not add up, a poll that overruns its slot
+        # restarts the schedule instead of bursting to catch up. Failed polls
+        # are not retried by default, a retry would only delay the next sample
+        due = time.monotonic()
+        while True:
+            try:
+                value = self.query(key, address, timeout=timeout, retry=retry)
+            except Mks901PError:
+                value = None
+            now = time.monotonic()
+            yield now, value
+            if period:
+                due += period
+                if due > now:
+                    time.sleep(due - now)
+                else:
+                    due = now
+
+    def _transact(self, frame, address, timeout=None, retry=None):
+        # write frame and return pop_reply's tuple for its ACK, retrying
+        # timeouts, garbled replies and RETRY_NAK_CODES as the policy allows
+        retry = retry or self.retry
+        if timeout is None:
+            timeout = self.timeout
+        port = self.serial_port
+        stats = self.stats
+        budget_end = retry.budget_end(time.monotonic())
+        attempt = 0
+        while True:
+            stats['requests'] += 1
+            # waiting for a late reply does not count against this attempt
+            self._discard_input(_deadline(timeout, budget_end))
+            deadline = _deadline(timeout, budget_end)
+            port.write(frame)
+            reply = self._read_reply(deadline, address)
+            error = self._check_reply(reply, frame, address)
+            if error is None:
+                return reply
+            delay = retry.wait_after(error, attempt, time.monotonic(), budget_end)
             if DEBUG:
-                print('no ACK received from cmd')
-            return None
+                print('retrying {} after {}'.format(frame, error))
+            time.sleep(delay)
+            attempt += 1
+            stats['retries'] += 1
 
+    def _check_reply(self, reply, frame, address):
+        # check_reply, a timed out broadcast's reply may still turn up later
+        if reply is None and address == broadcast_address_1:
+            self._late += 1
+        return check_reply(reply, frame, address, self.stats)
 
-import os
-import sys
-import time
-from ds18b20 import DS18B20	
+    def _transact_many(self, requests, timeout, pipeline):
+        # requests: list of (result key, address, CompiledCommand, frame bytes)
+        if not self.serial_port:
+            return('no connection')
+        if timeout is None:
+            timeout = self.timeout
+        results = dict.fromkeys([request[0] for request in requests])
+        self.last_errors = {}
+        pending = requests
+        if pipeline:
+            # one burst, replies are matched to requests by their order, so
+            # from the first one that does not come back cleanly on the rest
+            # go through the normal retry path below
+            pending = []
+            self._discard_input(time.monotonic() + timeout)
+            self.serial_port.write(b''.join([frame for _, _, _, frame in requests]))
+            for i, request in enumerate(requests):
+                query, addr, cmd, frame = request
+                self.stats['requests'] += 1
+                reply = self._read_reply(time.monotonic() + timeout, addr)
+                if self._check_reply(reply, frame, addr) is None:
+                    try:
+                        results[query] = cmd.convert(reply[2])
+                        continue
+                    except ValueError:
+                        pass
+                # the replies to the rest of the burst are still to come
+                self._late += sum(1 for request in requests[i + 1:] if request[1] == broadcast_address_1)
+                pending = requests[i:]
+                break
+        for query, addr, cmd, frame in pending:
+            try:
+                reply = self._transact(frame, addr, timeout)
+                results[query] = cmd.convert(reply[2])
+            except Mks901PError as e:
+                self.last_errors[query] = e
+            except ValueError:
+                self.last_errors[query] = Mks901PError('unexpected value {} for {}'.format(reply[2], cmd.key))
+        return results
+
+    def _discard_input(self, deadline):
+        # drop whatever is left of a late or partial reply to an earlier
+        # command. After a broadcast timed out its reply may still be on its
+        # way, where it would pass for the reply to the next command as it
+        # has no address to tell them apart, so wait for it until deadline.
+        # Late replies to addressed requests are left to _read_reply
+        while self._late:
+            self._late -= 1
+            if self._read_reply(deadline) is None:
+                break
+            self.stats['late_replies'] += 1
+        self._late = 0
+        del self._rx[:]
+        if self.serial_port.in_waiting:
+            self.serial_port.reset_input_buffer()
+
+    def _read_reply(self, deadline, address=broadcast_address_1):
+        # read from the port until a complete @...;FF frame from address is
+        # buffered or the deadline passes, returns pop_reply's tuple or None
+        # on timeout. Frames from other addresses are late replies to earlier
+        # requests and dropped, a broadcast takes a frame from any address
+        buf = self._rx
+        port = self.serial_port
+        while True:
+            reply = pop_reply(buf)
+            if reply is not None:
+                if address >= broadcast_address_1 or reply[0] == address:
+                    return reply
+                self.stats['late_replies'] += 1
+                continue
+            if time.monotonic() >= deadline:
+                return None
+            # returns after READ_POLL at most, the deadline may pass by that much
+            buf += port.read(max(1, port.in_waiting))
 
-this_files_path = os.path.abspath(__file__)
+def _make_getter(key):
+    def getter(self, address=broadcast_address_1, return_address=False):
+        return self.query(key, address, return_address=return_address)
+    return getter
+
+def _make_setter(key):
+    def setter(self, value, address=broadcast_address_1):
+        return self.query(key, address, value=value)
+    return setter
+
+def _make_action(key):
+    def action(self, value=None, address=broadcast_address_1):
+        return self.query(key, address, value=value)
+    return action
+
+def command_methods(make_getter, make_setter, make_action):
+    # (method name, function) for every commands entry, queries take an
+    # address, set commands a value and perform_ adjustments an optional value
+    methods = []
+    for key, cmd in compiled_commands.items():
+        if not cmd.takes_value:
+            method = make_getter(key)
+        elif cmd.default_value is None:
+            method = make_setter(key)
+        else:
+            method = make_action(key)
+        method.__name__ = command_method_name(key)
+        method.__doc__ = command_lookup[key].get('Explanation', command_lookup[key].get('Explanantion'))
+        methods.append((method.__name__, method))
+    return methods
+
+# typed get/set methods for the whole commands table, e.g. m.get_setpoint_1()
+# or m.set_setpoint_1(2.0e1), hand written methods above take precedence
+for _name, _method in command_methods(_make_getter, _make_setter, _make_action):
+    if not hasattr(Mks901P, _name):
+        setattr(Mks901P, _name, _method)
+
+class RateStats(object):
+    # sample rate and timing jitter of a stream of monotonic timestamps,
+    # jitter is the standard deviation of the intervals between samples
+    def __init__(self):
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.min_interval = None
+        self.max_interval = None
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, timestamp):
+        if self.last is None:
+            self.first = timestamp
+        else:
+            interval = timestamp - self.last
+            n = self.count  # intervals including this one
+            delta = interval - self._mean
+            self._mean += delta / n
+            self._m2 += delta * (interval - self._mean)
+            self.min_interval = interval if self.min_interval is None else min(self.min_interval, interval)
+            self.max_interval = interval if self.max_interval is None else max(self.max_interval, interval)
+        self.last = timestamp
+        self.count += 1
+
+    def rate(self):
+        if self.count < 2 or self.last == self.first:
+            return 0.0
+        return (self.count - 1) / (self.last - self.first)
+
+    def jitter(self):
+        if self.count < 3:
+            return 0.0
+        return (self._m2 / (self.count - 2)) ** 0.5
+
+    def summary(self):
+        if self.count < 2:
+            return '{} samples'.format(self.count)
+        return '{} samples, {:.1f} Hz, interval {:.2f} ms (min {:.2f}, max {:.2f}), jitter {:.3f} ms'.format(
+            self.count, self.rate(), self._mean * 1000, self.min_interval * 1000,
+            self.max_interval * 1000, self.jitter() * 1000)
 
 if __name__ == '__main__':
     import argparse
+    import sys
+    from ds18b20 import DS18B20, format_reading
+    from pressure_log import RotatingLogWriter, temperature_values
     parser = argparse.ArgumentParser()
     parser.add_argument("serial_port", help='the Windows COM port or path to a linux serial port')
     parser.add_argument("--find_baud", help='tries to access the sensor over all supported baud rates, prints which is successful', action="store_true")
     parser.add_argument("--baud", help='baud rate to connect with, defaults to 9600 (901p factory default)', type=int)
     parser.add_argument("-unit", help='print pressure unit with each reading', action="store_true")
     parser.add_argument("-pi_lcd", help='print pressure to RasPi LCD', action="store_true")
-    parser.add_argument("-sleep", help='amount to sleep between pressure readings, default 1 second', type=int)
+    parser.add_argument("-sleep", help='amount to sleep between pressure readings, default 1 second', type=float)
+    parser.add_argument("-stream", help='poll as fast as the link allows (or every -sleep seconds), print each reading with its monotonic time, report sample rate and jitter when stopped', action="store_true")
+    parser.add_argument("-count", help='with -stream, stop after this many readings', type=int)
     args = parser.parse_args()
     com_port = args.serial_port
     if args.find_baud and not args.baud:
-        Mks901P.find_baud()
+        print(Mks901P.find_baud(com_port))
     elif args.find_baud and args.baud:
         if DEBUG:
             print('setting up connection using baudrate of: {}'.format(args.baud))
@@ -423,33 +1011,57 @@ if __name__ == '__main__':
             sleep_time = args.sleep
         if args.unit:
             unit = ' {}'.format(m.get_pressure_unit())
-        if args.pi_lcd:
+        if args.stream:
+            stats = RateStats()
+            failed = 0
+            try:
+                for timestamp, pressure in m.stream(period=args.sleep or 0):
+                    stats.add(timestamp)
+                    if pressure is None:
+                        failed += 1
+                    print('{:.6f} {}{}'.format(timestamp, format_pressure(pressure), unit))
+                    if args.count and stats.count >= args.count:
+                        break
+            except KeyboardInterrupt:
+                pass
+            print('{}, {} failed'.format(stats.summary(), failed), file=sys.stderr)
+        elif args.pi_lcd:
             import lcd
             lcd.setup_gpio()
+            renderer = lcd.LCDRenderer()
+            renderer.start()
             x = DS18B20()
-            count=x.device_count()
+            x.start_sampling()
             file_prefix = 'pressure_log_'
-            num_prev_files = len([item for item in os.listdir('.') if item.startswith(file_prefix)])
-            logfile = open(file_prefix+str(num_prev_files), 'w', buffering=128)
-            logfile.write(unit+'\n')
+            logfile = RotatingLogWriter(file_prefix, unit.strip(), x.rom_ids())
             try:
                 while True:
-                    pressure = '{}'.format(m.get_pressure_combined_4_digit())
-                    pressure_float = float(pressure)
+                    try:
+                        pressure_float = m.get_pressure_combined_4_digit()
+                    except Mks901PError as e:
+                        if DEBUG:
+                            print(e)
+                        pressure_float = None
+                    pressure = format_pressure(pressure_float)
                     pressure_string = '{}{}'.format(pressure, unit)
-                    temps = ' '.join([str(x.tempC(i)) for i in range(count)])
-                    logfile.write('{} {}\n'.format(pressure, temps))
-                    lcd.lcd_text(pressure_string, lcd.LCD_LINE_1)
-                    lcd.lcd_text('{}'.format(temps), lcd.LCD_LINE_2)
+                    readings = x.latest_all()
+                    temps = ' '.join([format_reading(t) for t in readings])
+                    logfile.append(time.time(), pressure_float, temperature_values(readings))
+                    renderer.set_line(1, pressure_string)
+                    renderer.set_line(2, temps)
                     time.sleep(sleep_time)
             except KeyboardInterrupt:
                 pass 
             finally:
+                renderer.stop()
                 lcd.lcd_write(0x01, lcd.LCD_CMD)
-                import RPi.GPIO as GPIO
                 lcd.lcd_text("Reading stopped!", lcd.LCD_LINE_1)
-                GPIO.cleanup()
+                lcd.GPIO.cleanup()
+                logfile.close()
         else:
             while True:
-                print('{}{}'.format(m.get_pressure_combined_4_digit(), unit))
+                try:
+                    print('{}{}'.format(format_pressure(m.get_pressure_combined_4_digit()), unit))
+                except Mks901PError as e:
+                    print(e)
                 time.sleep(sleep_time)
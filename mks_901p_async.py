@@ -0,0 +1,227 @@
+# asyncio client for the MKS 901p, needs pyserial-asyncio
+#
+#   async def main():
+#       m = await AsyncMks901P.open('/dev/ttyUSB0')
+#       print(await m.get_pressure_combined_4_digit())
+#       print(await m.query_many(['pirani', 'piezo', 'get_status']))
+#       m.close()
+#
+# Every command in mks_901p.commands is available as a coroutine method with
+# the same name and arguments as on Mks901P. A lock keeps one request on the bus at a
+# time, so any number of tasks on the loop can share the gauge.
+
+import asyncio
+
+import serial_asyncio
+
+from mks_901p import (DEBUG, Mks901PError, RetryPolicy, broadcast_address_1, check_reply,
+                      command_methods, compiled_commands, config_keys, format_address, pop_reply)
+
+
+class _FrameProtocol(asyncio.Protocol):
+    # collects received bytes and hands complete replies to the waiting request
+    def __init__(self):
+        self.transport = None
+        self.buf = bytearray()
+        self.waiter = None
+        # the waiter takes replies from this address, any for a broadcast
+        self.address = broadcast_address_1
+        # frames from other addresses dropped meanwhile, late replies
+        self.dropped = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buf += data
+        self.deliver()
+
+    def deliver(self):
+        while self.waiter is not None and not self.waiter.done():
+            reply = pop_reply(self.buf)
+            if reply is None:
+                return
+            if self.address >= broadcast_address_1 or reply[0] == self.address:
+                self.waiter.set_result(reply)
+            else:
+                self.dropped += 1
+
+    def connection_lost(self, exc):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_exception(exc or ConnectionError('serial port closed'))
+
+
+class AsyncMks901P(object):
+    def __init__(self, transport, protocol, com_port_name, timeout=1, retry=None):
+        # use AsyncMks901P.open() instead of creating this directly
+        self.com_port_name = com_port_name
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy()
+        # late_replies: replies to timed out requests dropped before the next one
+        self.stats = dict.fromkeys(('requests', 'retries', 'timeouts', 'naks', 'late_replies'), 0)
+        self.last_errors = {}
+        self.pressure_unit = None
+        self._transport = transport
+        self._protocol = protocol
+        self._lock = asyncio.Lock()
+        # replies to timed out broadcast requests that may still be on their way
+        self._late = 0
+
+    @classmethod
+    async def open(cls, com_port_name, baud=9600, timeout=1, retry=None):
+        loop = asyncio.get_running_loop()
+        transport, protocol = await serial_asyncio.create_serial_connection(
+            loop, _FrameProtocol, com_port_name, baudrate=baud)
+        return cls(transport, protocol, com_port_name, timeout, retry)
+
+    def close(self):
+        self._transport.close()
+
+    async def query(self, key, address=broadcast_address_1, timeout=None, return_address=False, value=None, retry=None):
+        # same contract as Mks901P.query
+        cmd = compiled_commands[key]
+        reply = await self._transact(cmd.frame(address, value), address, timeout, retry)
+        try:
+            value = cmd.convert(reply[2])
+        except ValueError:
+            raise Mks901PError('unexpected value {} for {}'.format(reply[2], key))
+        if return_address:
+            return (reply[0], value)
+        return value
+
+    async def send_cmd(self, cmd, expected_response, address, timeout=None, retry=None):
+        # same contract as Mks901P.send_cmd
+        frame = cmd.format(format_address(address)).encode()
+        reply = await self._transact(frame, address, timeout, retry)
+        return (format_address(reply[0]), reply[2].decode())
+
+    async def query_many(self, queries, address=broadcast_address_1, timeout=None):
+        # same contract as Mks901P.query_many, the whole batch holds the bus
+        requests = []
+        for query in queries:
+            if isinstance(query, tuple):
+                addr, key = query
+            else:
+                addr, key = address, query
+            cmd = compiled_commands[key]
+            requests.append((query, addr, cmd, cmd.frame(addr)))
+        return await self._transact_many(requests, timeout)
+
+    async def configure(self, settings, address=broadcast_address_1, timeout=None):
+        # same contract as Mks901P.configure
+        requests = []
+        for key, value in settings.items():
+            cmd = compiled_commands[key]
+            requests.append((key, address, cmd, cmd.frame(address, value)))
+        return await self._transact_many(requests, timeout)
+
+    async def read_config(self, address=broadcast_address_1, timeout=None):
+        return await self.query_many(config_keys, address, timeout)
+
+    async def _transact_many(self, requests, timeout):
+        # requests: list of (result key, address, CompiledCommand, frame bytes)
+        results = dict.fromkeys([request[0] for request in requests])
+        self.last_errors = {}
+        async with self._lock:
+            for query, addr, cmd, frame in requests:
+                try:
+                    reply = await self._transact_locked(frame, addr, timeout, None)
+                    results[query] = cmd.convert(reply[2])
+                except Mks901PError as e:
+                    self.last_errors[query] = e
+                except ValueError:
+                    self.last_errors[query] = Mks901PError('unexpected value {} for {}'.format(reply[2], cmd.key))
+        return results
+
+    async def _transact(self, frame, address, timeout, retry):
+        async with self._lock:
+            return await self._transact_locked(frame, address, timeout, retry)
+
+    async def _transact_locked(self, frame, address, timeout, retry):
+        # same retry rules as Mks901P._transact, caller holds the lock
+        retry = retry or self.retry
+        if timeout is None:
+            timeout = self.timeout
+        loop = asyncio.get_running_loop()
+        budget_end = retry.budget_end(loop.time())
+        attempt = 0
+        while True:
+            self.stats['requests'] += 1
+            attempt_timeout = timeout
+            if budget_end is not None:
+                attempt_timeout = max(0, min(timeout, budget_end - loop.time()))
+            reply = await self._exchange(frame, address, attempt_timeout)
+            error = check_reply(reply, frame, address, self.stats)
+            if error is None:
+                return reply
+            await asyncio.sleep(retry.wait_after(error, attempt, loop.time(), budget_end))
+            attempt += 1
+            self.stats['retries'] += 1
+
+    async def _exchange(self, frame, address, timeout):
+        # write one frame and wait for pop_reply's tuple, None on timeout.
+        # Same late reply rules as Mks901P._discard_input: the reply to a
+        # timed out broadcast is waited for first, it would pass for this
+        # one's, late replies from other addresses are dropped while waiting
+        while self._late:
+            self._late -= 1
+            if await self._wait_reply(broadcast_address_1, timeout) is None:
+                break
+            self.stats['late_replies'] += 1
+        self._late = 0
+        del self._protocol.buf[:]
+        self._transport.write(frame)
+        reply = await self._wait_reply(address, timeout)
+        if reply is None:
+            if DEBUG:
+                print('timed out waiting for reply to {}'.format(frame))
+            if address == broadcast_address_1:
+                self._late += 1
+        return reply
+
+    async def _wait_reply(self, address, timeout):
+        protocol = self._protocol
+        protocol.waiter = asyncio.get_running_loop().create_future()
+        protocol.address = address
+        # a reply may be buffered already
+        protocol.deliver()
+        try:
+            return await asyncio.wait_for(protocol.waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            protocol.waiter = None
+            self.stats['late_replies'] += protocol.dropped
+            protocol.dropped = 0
+
+    async def get_pressure_unit(self, address=broadcast_address_1):
+        unit = await self.query('get_pressure_unit', address)
+        if unit:
+            self.pressure_unit = unit
+            return self.pressure_unit
+
+    async def get_pressure_combined_4_digit(self, address=broadcast_address_1, return_address=False):
+        return await self.query('combined_4_digit', address, return_address=return_address)
+
+
+def _make_getter(key):
+    async def getter(self, address=broadcast_address_1, return_address=False):
+        return await self.query(key, address, return_address=return_address)
+    return getter
+
+
+def _make_setter(key):
+    async def setter(self, value, address=broadcast_address_1):
+        return await self.query(key, address, value=value)
+    return setter
+
+
+def _make_action(key):
+    async def action(self, value=None, address=broadcast_address_1):
+        return await self.query(key, address, value=value)
+    return action
+
+
+for _name, _method in command_methods(_make_getter, _make_setter, _make_action):
+    if not hasattr(AsyncMks901P, _name):
+        setattr(AsyncMks901P, _name, _method)
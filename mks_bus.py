@@ -0,0 +1,166 @@
+# Poll several MKS 901p transducers sharing one RS-485 bus.
+#
+# One Mks901P object owns the serial port, the poller talks to every gauge
+# through it by address and runs each (address, command) pair at its own rate.
+#
+#   m = Mks901P('/dev/ttyUSB0')
+#   poller = BusPoller(m)
+#   for address in poller.discover(range(1, 11)):
+#       poller.add(address, 'combined_4_digit', 10)
+#       poller.add(address, 'get_pirani_temp', 0.1)
+#   poller.start()
+#   ...
+#   print(poller.latest, poller.bus_load(), poller.utilization())
+#
+# Polls are not retried and wait only a little longer than the transaction
+# takes, a gauge that does not answer must not cost the others their slots.
+# An address that keeps failing is polled less and less often, down to once
+# every MAX_BACKOFF seconds, until it answers again.
+
+import heapq
+import time
+from threading import Thread, Event, Lock
+
+from mks_901p import NO_RETRY, Mks901PError, command_lookup, format_address
+
+# bits per character on the wire, 8N1
+BITS_PER_CHAR = 10
+# allowance for the transducer turning the line around between request and reply
+TURNAROUND = 0.005
+# longest a failing address is left alone before it is polled again
+MAX_BACKOFF = 5.0
+
+
+class BusPoller(object):
+    def __init__(self, gauge, callback=None, timeout=None):
+        # gauge: Mks901P whose serial port is shared by every polled address
+        # callback: optional callable(address, key, value, timestamp) run per sample
+        # timeout: seconds to wait for a reply, default twice the transaction
+        #          time of the command plus TURNAROUND
+        self.gauge = gauge
+        self.callback = callback
+        self.timeout = timeout
+        self.latest = {}  # (address, key) -> (timestamp, value)
+        self.missed = {}  # (address, key) -> number of slots skipped while late
+        self.errors = {}  # (address, key) -> number of failed transactions
+        self.failures = {}  # address -> failed transactions since its last reply
+        self._schedule = []
+        self._seq = 0
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+        self._busy = 0.0
+        self._started = None
+
+    def discover(self, addresses=range(1, 254), timeout=0.1):
+        # ask every address for its address, return the ones that answered
+        found = []
+        for address in addresses:
+            try:
+                output = self.gauge.query('get_address', address, timeout=timeout,
+                                          return_address=True, retry=NO_RETRY)
+            except Mks901PError:
+                continue
+            if output[0] == int(address):
+                found.append(int(address))
+        return found
+
+    def add(self, address, key, rate):
+        # poll command key on address rate times per second
+        period = 1.0 / rate
+        with self._lock:
+            heapq.heappush(self._schedule, [time.monotonic(), self._seq, address, key, period])
+            self._seq += 1
+            self.missed.setdefault((address, key), 0)
+            self.errors.setdefault((address, key), 0)
+            self.failures.setdefault(address, 0)
+
+    def remove(self, address, key=None):
+        with self._lock:
+            self._schedule = [job for job in self._schedule
+                              if not (job[2] == address and key in (None, job[3]))]
+            heapq.heapify(self._schedule)
+
+    def transaction_time(self, key):
+        # estimated seconds one request/reply pair occupies the bus
+        cmd = command_lookup[key]
+        chars = len(cmd['Command'].format(format_address(0))) + len(cmd['Response'])
+        return chars * BITS_PER_CHAR / float(self.gauge.serial_port.baudrate) + TURNAROUND
+
+    def bus_load(self):
+        # fraction of bus time the current schedule needs, above 1.0 the
+        # schedule cannot be met and slower jobs start missing their slots
+        with self._lock:
+            return sum(self.transaction_time(job[3]) / job[4] for job in self._schedule)
+
+    def utilization(self):
+        # measured fraction of time spent in transactions since start()
+        if not self._started:
+            return 0.0
+        elapsed = time.monotonic() - self._started
+        return self._busy / elapsed if elapsed > 0 else 0.0
+
+    def reply_timeout(self, key):
+        # seconds a poll of key waits for its reply
+        if self.timeout is not None:
+            return self.timeout
+        return 2 * self.transaction_time(key) + TURNAROUND
+
+    def poll_once(self):
+        # run every job that is due, return seconds until the next one,
+        # None once stopped or when there are no jobs
+        while not self._stop.is_set():
+            with self._lock:
+                if not self._schedule:
+                    return None
+                job = self._schedule[0]
+                now = time.monotonic()
+                if job[0] > now:
+                    return job[0] - now
+                due, _, address, key, period = job
+                # skip slots that have already passed instead of bursting to catch up
+                next_due = due + period
+                if next_due <= now:
+                    skipped = int((now - due) / period)
+                    self.missed[(address, key)] += skipped
+                    next_due = due + (skipped + 1) * period
+                job[0] = next_due
+                heapq.heapreplace(self._schedule, job)
+            try:
+                value = self.gauge.query(key, address, timeout=self.reply_timeout(key), retry=NO_RETRY)
+            except Mks901PError:
+                finished = time.monotonic()
+                self._busy += finished - now
+                self.errors[(address, key)] += 1
+                self.failures[address] += 1
+                # leave the address alone for a while, longer each time
+                backoff = min(period * 2 ** self.failures[address], MAX_BACKOFF)
+                with self._lock:
+                    if job[0] < finished + backoff:
+                        job[0] = finished + backoff
+                        heapq.heapify(self._schedule)
+                continue
+            finished = time.monotonic()
+            self._busy += finished - now
+            self.failures[address] = 0
+            self.latest[(address, key)] = (finished, value)
+            if self.callback:
+                self.callback(address, key, value, finished)
+
+    def run(self):
+        self._started = time.monotonic()
+        self._busy = 0.0
+        while not self._stop.is_set():
+            wait = self.poll_once()
+            self._stop.wait(1.0 if wait is None else wait)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
@@ -0,0 +1,458 @@
+# Binary pressure/temperature log.
+#
+# A log file is a small header followed by fixed width little endian records:
+#
+#   magic      8 bytes  b'VACLOG1\n'
+#   length     uint32   size of the JSON header that follows
+#   header     JSON     {"unit": "TORR", "rom_ids": [...], "fields": [...]}
+#   padding    spaces up to a multiple of 8 bytes, where the first record starts
+#   records    time float64 (time.time()), pressure float64,
+#              valves uint32 (bit mask of open valves), N x temperature float32
+#
+# Records are packed, 20 + 4 N bytes each, so in general only the first one is
+# 8 byte aligned. The reader's dtype is packed too and does not need more.
+#
+# Missing pressures and temperatures are stored as NaN. A record cut short by
+# a crash is ignored by the reader. Writing needs nothing beyond the standard
+# library, reading maps the file into NumPy arrays without copying it:
+#
+#   log = read_log('pressure_log_3')
+#   log.header['unit'], log.time, log.pressure, log.temps[:, 0]
+
+import json
+import os
+import struct
+import threading
+import time
+
+from ds18b20 import GOOD
+from sample_bus import Ring
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'VACLOG1\n'
+NAN = float('nan')
+
+
+def record_struct(sensor_count):
+    return struct.Struct('<ddI{}f'.format(sensor_count))
+
+
+def record_dtype(sensor_count):
+    return np.dtype([('time', '<f8'), ('pressure', '<f8'), ('valves', '<u4'),
+                     ('temps', '<f4', (sensor_count,))])
+
+
+def encode_header(unit, rom_ids, **extra):
+    header = dict(extra, unit=unit, rom_ids=list(rom_ids),
+                  fields=['time', 'pressure', 'valves', 'temps'])
+    body = json.dumps(header).encode()
+    size = len(MAGIC) + 4 + len(body)
+    body += b' ' * (-size % 8)
+    return MAGIC + struct.pack('<I', len(body)) + body
+
+
+def decode_header(f):
+    # return: (header dict, offset of the first record)
+    magic = f.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError('not a pressure log')
+    length, = struct.unpack('<I', f.read(4))
+    header = json.loads(f.read(length).decode())
+    return header, len(MAGIC) + 4 + length
+
+
+class PressureLogWriter(object):
+    def __init__(self, path, unit, rom_ids, buffering=-1):
+        # unit: pressure unit string, rom_ids: one per temperature column
+        self.path = path
+        self.sensor_count = len(rom_ids)
+        self._struct = record_struct(self.sensor_count)
+        self._pad = (NAN,) * self.sensor_count
+        self.record_size = self._struct.size
+        self.file = open(path, 'wb', buffering=buffering)
+        self.file.write(encode_header(unit, rom_ids))
+
+    def encode(self, timestamp, pressure, temps=(), valves=0):
+        # temps: degrees C or None per sensor, a short list is padded with NaN
+        temps = tuple(NAN if t is None else t for t in temps[:self.sensor_count])
+        if pressure is None:
+            pressure = NAN
+        return self._struct.pack(timestamp, pressure, valves, *(temps + self._pad[len(temps):]))
+
+    def append(self, timestamp, pressure, temps=(), valves=0):
+        self.file.write(self.encode(timestamp, pressure, temps, valves))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class PressureLog(object):
+    # a log file mapped into memory, the arrays are views of the mapping
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.header, offset = decode_header(f)
+        self.path = path
+        self.offset = offset
+        dtype = record_dtype(len(self.header['rom_ids']))
+        count = (os.path.getsize(path) - offset) // dtype.itemsize
+        if count:
+            self.records = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def time(self):
+        return self.records['time']
+
+    @property
+    def pressure(self):
+        return self.records['pressure']
+
+    @property
+    def valves(self):
+        return self.records['valves']
+
+    @property
+    def temps(self):
+        # shape (records, sensors), columns in header['rom_ids'] order
+        return self.records['temps']
+
+
+def read_log(path):
+    if np is None:
+        raise ImportError('reading pressure logs needs numpy')
+    return PressureLog(path)
+
+
+def temperature_values(readings):
+    # ds18b20 Readings to what the log stores, only good values are kept
+    return [r.value if r.quality == GOOD else None for r in readings]
+
+
+# Rotation and the chunk index.
+#
+# A long run is split over numbered files, pressure_log_0, pressure_log_1, ...
+# A new file is started once the current one reaches max_bytes or covers
+# max_seconds. Every chunk_records records the writer notes in a sidecar
+# index, pressure_log_index, where the chunk starts:
+#
+#   <time of the chunk's first record> <file name> <byte offset>
+#
+# so a time range query only maps and reads the chunks that overlap it.
+#
+#   log = RotatingLogWriter('pressure_log_', 'TORR', rom_ids)
+#   log.append(time.time(), pressure, temps, valves)
+#   log.close()
+#   ...
+#   day = LogArchive('pressure_log_').query(time.time() - 86400, downsample=60)
+#   day['time'], day['pressure_min'], day['pressure_mean'], day['pressure_max']
+
+INDEX_SUFFIX = 'index'
+
+
+def log_files(prefix):
+    # {number: path} of the numbered log files with this path prefix
+    directory, base = os.path.split(prefix)
+    files = {}
+    for name in os.listdir(directory or '.'):
+        number = name[len(base):]
+        if name.startswith(base) and number.isdigit():
+            files[int(number)] = os.path.join(directory, name)
+    return files
+
+
+class RotatingLogWriter(object):
+    def __init__(self, prefix, unit, rom_ids, max_bytes=64 * 1024 * 1024,
+                 max_seconds=24 * 3600, chunk_records=1024, buffering=-1):
+        # prefix: path the numbered files start with, e.g. 'logs/pressure_log_'
+        self.prefix = prefix
+        self.unit = unit
+        self.rom_ids = list(rom_ids)
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.chunk_records = chunk_records
+        self.buffering = buffering
+        files = log_files(prefix)
+        self.number = max(files) + 1 if files else 0
+        self.index = open(prefix + INDEX_SUFFIX, 'a')
+        self.writer = None
+        self._open()
+
+    def _open(self):
+        self.writer = PressureLogWriter(self.prefix + str(self.number), self.unit,
+                                        self.rom_ids, self.buffering)
+        self.path = self.writer.path
+        self.size = self.writer.file.tell()
+        self._chunk_fill = 0
+        self._file_start = None
+
+    def _rotate(self):
+        self.sync()
+        self.writer.close()
+        self.number += 1
+        self._open()
+
+    def _start_chunk(self, timestamp):
+        # called before the first record of a chunk is written
+        if self._file_start is None:
+            self._file_start = timestamp
+        elif (self.size >= self.max_bytes
+              or timestamp - self._file_start >= self.max_seconds):
+            self._rotate()
+            self._file_start = timestamp
+        self.index.write('{!r} {} {}\n'.format(timestamp, os.path.basename(self.path), self.size))
+        self.index.flush()
+
+    def append(self, timestamp, pressure, temps=(), valves=0):
+        self.append_many([(timestamp, pressure, temps, valves)])
+
+    def append_many(self, records):
+        # records: (timestamp, pressure, temps, valves) tuples, the records
+        # of one chunk go out in a single write
+        i = 0
+        while i < len(records):
+            if self._chunk_fill == 0:
+                self._start_chunk(records[i][0])
+            n = min(len(records) - i, self.chunk_records - self._chunk_fill)
+            data = b''.join([self.writer.encode(*record) for record in records[i:i + n]])
+            self.writer.file.write(data)
+            self.size += len(data)
+            self._chunk_fill = (self._chunk_fill + n) % self.chunk_records
+            i += n
+
+    def flush(self):
+        self.writer.flush()
+
+    def sync(self):
+        # make everything written so far survive a power cut
+        self.writer.flush()
+        os.fsync(self.writer.file.fileno())
+        os.fsync(self.index.fileno())
+
+    def close(self):
+        self.writer.close()
+        self.index.close()
+
+
+class LogWriteError(IOError):
+    # the committer thread could not write or sync, logging has stopped
+    pass
+
+
+class LogCommitter(object):
+    # Writes a RotatingLogWriter from its own thread so samplers never wait
+    # on the disk. put() only adds a record to a bounded ring, the thread
+    # takes everything buffered since its last pass as one batch and writes
+    # it in one go. It fsyncs once sync_bytes bytes are unsynced or the
+    # oldest unsynced record is sync_interval seconds old, so a power cut
+    # loses at most that window. Should the disk fall behind by more than
+    # max_queue records the oldest are dropped and counted in stats.
+    # Open the writer with buffering=0 so a batch is exactly one write.
+    # Should a write or sync fail the thread stops, the error is kept in
+    # self.error and put() and stop() raise LogWriteError from then on.
+    def __init__(self, log, sync_interval=1.0, sync_bytes=64 * 1024, max_queue=65536):
+        self.log = log
+        self.sync_interval = sync_interval
+        self.sync_bytes = sync_bytes
+        # lost: records taken for writing but not on disk because of an error
+        self.stats = {'records': 0, 'batches': 0, 'syncs': 0, 'max_depth': 0,
+                      'dropped': 0, 'lost': 0, 'last_flush': 0.0, 'max_flush': 0.0}
+        self.error = None
+        self._unsynced_records = 0
+        self._ring = Ring(max_queue)
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def put(self, timestamp, pressure, temps=(), valves=0):
+        if self.error is not None:
+            self._raise()
+        self._ring.append((timestamp, pressure, temps, valves))
+        if len(self._ring) > self.stats['max_depth']:
+            self.stats['max_depth'] = len(self._ring)
+        self._wake.set()
+
+    def depth(self):
+        # records waiting to be written
+        return len(self._ring)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        # returns once everything queued is written and synced
+        self._running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+        if self.error is not None:
+            self._raise()
+
+    def _raise(self):
+        raise LogWriteError('logging stopped: {}'.format(self.error)) from self.error
+
+    def _run(self):
+        try:
+            self._commit()
+        except Exception as e:
+            # whatever was taken but not synced may not be on disk
+            self.stats['lost'] += self._unsynced_records
+            self.error = e
+
+    def _commit(self):
+        unsynced = 0
+        sync_due = None
+        while True:
+            self._wake.wait(None if sync_due is None else max(0, sync_due - time.monotonic()))
+            self._wake.clear()
+            running = self._running
+            batch = self._ring.drain()
+            self.stats['dropped'] = self._ring.dropped
+            started = time.monotonic()
+            if batch:
+                self._unsynced_records += len(batch)
+                self.log.append_many(batch)
+                unsynced += len(batch) * self.log.writer.record_size
+                self.stats['records'] += len(batch)
+                self.stats['batches'] += 1
+                if sync_due is None:
+                    sync_due = started + self.sync_interval
+            if unsynced and (not running or unsynced >= self.sync_bytes
+                             or time.monotonic() >= sync_due):
+                self.log.sync()
+                self.stats['syncs'] += 1
+                self._unsynced_records = 0
+                unsynced = 0
+                sync_due = None
+            if batch:
+                # seconds from taking the batch to it being written (and synced)
+                flush = time.monotonic() - started
+                self.stats['last_flush'] = flush
+                self.stats['max_flush'] = max(self.stats['max_flush'], flush)
+            if not running:
+                return
+
+
+class LogArchive(object):
+    # time range queries over the files of a RotatingLogWriter
+    def __init__(self, prefix):
+        if np is None:
+            raise ImportError('reading pressure logs needs numpy')
+        self.prefix = prefix
+        self.directory = os.path.dirname(prefix)
+        self._logs = {}
+
+    def read_index(self):
+        # [(chunk start time, file name, offset)], in write order
+        entries = []
+        with open(self.prefix + INDEX_SUFFIX) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3:
+                    entries.append((float(parts[0]), parts[1], int(parts[2])))
+        return entries
+
+    def _log(self, name):
+        # maps are cached, a file still being written is mapped again
+        # whenever it has grown
+        path = os.path.join(self.directory, name)
+        log = self._logs.get(name)
+        if log is None or os.path.getsize(path) != log.size:
+            log = PressureLog(path)
+            log.size = os.path.getsize(path)
+            self._logs[name] = log
+        return log
+
+    def chunks(self, start=None, end=None):
+        # [(file name, first byte, end byte or None)] that may hold records
+        # between start and end, end byte None means up to the end of the file
+        entries = self.read_index()
+        spans = []
+        for i, (t, name, offset) in enumerate(entries):
+            following = entries[i + 1] if i + 1 < len(entries) else None
+            if end is not None and t > end:
+                break
+            # a chunk ends where the next one starts
+            if start is not None and following is not None and following[0] <= start:
+                continue
+            stop = following[2] if following is not None and following[1] == name else None
+            if spans and spans[-1][0] == name and spans[-1][2] == offset:
+                spans[-1] = (name, spans[-1][1], stop)
+            else:
+                spans.append((name, offset, stop))
+        return spans
+
+    def records(self, start=None, end=None):
+        # the records with start <= time <= end as one structured array
+        parts = []
+        width = 0
+        for name, first, stop in self.chunks(start, end):
+            log = self._log(name)
+            size = log.records.dtype.itemsize
+            first = (first - log.offset) // size
+            stop = len(log) if stop is None else (stop - log.offset) // size
+            records = log.records[first:stop]
+            times = records['time']
+            lo = 0 if start is None else np.searchsorted(times, start, 'left')
+            hi = len(records) if end is None else np.searchsorted(times, end, 'right')
+            parts.append(records[lo:hi])
+            width = max(width, log.temps.shape[1])
+        dtype = record_dtype(width)
+        out = np.empty(sum(len(p) for p in parts), dtype=dtype)
+        out['temps'] = np.nan
+        i = 0
+        for part in parts:
+            n = len(part)
+            for field in ('time', 'pressure', 'valves'):
+                out[field][i:i + n] = part[field]
+            out['temps'][i:i + n, :part['temps'].shape[1]] = part['temps']
+            i += n
+        return out
+
+    def query(self, start=None, end=None, downsample=None):
+        # records between start and end (time.time() values, None for open
+        # ended), raw when downsample is None, otherwise reduced to buckets
+        # of downsample seconds: a dict of arrays with the bucket start
+        # 'time', the record 'count' and min, max and mean of the pressure
+        # and of every temperature column, NaN where a bucket has no values
+        records = self.records(start, end)
+        if downsample is None:
+            return records
+        times = records['time']
+        if start is None:
+            start = times[0] if len(times) else 0.0
+        bucket = np.floor((times - start) / downsample).astype(np.int64)
+        # records are in time order, so each bucket is one run of records
+        firsts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]]) if len(bucket) else bucket
+        result = {
+            'time': start + bucket[firsts] * downsample,
+            'count': np.diff(np.r_[firsts, len(bucket)]),
+        }
+        for field in ('pressure', 'temps'):
+            values = records[field].astype(np.float64)
+            if not len(firsts):
+                for stat in ('min', 'max', 'mean'):
+                    result[field + '_' + stat] = values[:0]
+                continue
+            valid = ~np.isnan(values)
+            counts = np.add.reduceat(valid, firsts)
+            sums = np.add.reduceat(np.where(valid, values, 0.0), firsts)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[field + '_mean'] = sums / counts
+            # fmin/fmax skip NaN unless a whole bucket is NaN
+            result[field + '_min'] = np.fmin.reduceat(values, firsts)
+            result[field + '_max'] = np.fmax.reduceat(values, firsts)
+        return result
@@ -0,0 +1,173 @@
+# Deposition recipes.
+#
+# A recipe is a JSON file describing a process as a graph of phases, see
+# recipes/fdts.json:
+#
+#   {
+#     "name": "...",
+#     "start": "pump_down",
+#     "filter": {"alpha": 0.3, "beta": 0.05},
+#     "phases": {
+#       "pump_down": {
+#         "transitions": [
+#           {"when": {"pressure_below": 0.3}, "do": [{"close": "isolation"}], "next": "water_dose"}
+#         ]
+#       },
+#       "water_dose": {
+#         "pulse": {"valve": "water", "seconds": 0.1, "target": 5.5, "max_seconds": 0.5},
+#         "transitions": [{"when": {"pressure_above": 5}, "next": "adsorption"}]
+#       },
+#       ...
+#       "done": {}
+#     }
+#   }
+#
+# With a filter the pressure conditions look at the smoothed pressure of a
+# trend.PressureTrend with these settings instead of the raw samples, so noise
+# around a threshold does not flap between phases. It lags the samples but
+# never runs ahead of them, only "lead" goes by the trend's slope.
+#
+# A phase has
+#   pulse        a valve to keep pulsing, one pulse at a time, while in the phase,
+#                for "seconds" each; with a "target" pressure the pulses are
+#                planned by dosing.py instead: the first one is "seconds",
+#                later ones up to "max_seconds" (default "seconds") as needed
+#                to reach the target, each after the pressure of the one
+#                before has settled for "settle" seconds (default 1), a pulse
+#                shorter than "min_seconds" (default 0) counts as on target
+#   transitions  tried in order on every sample, the first one that applies is
+#                taken, a phase without transitions ends the recipe
+# and a transition
+#   when         conditions that must all hold: pressure_below, pressure_above,
+#                temperature_below, temperature_above, the temperatures are
+#                of sensor index "sensor" (default 0) and only good readings count
+#   lead         with a filter, pressure conditions also hold when the trend
+#                reaches the threshold within this many seconds or its level
+#                is already past it, e.g. to close a valve ahead of the
+#                crossing by its switching time
+#   after        seconds spent in the phase before the transition applies,
+#                without "when" it is taken as soon as they have passed
+#   times        take the transition at most this many times per run
+#   do           actions on the way: {"open": valve}, {"close": valve},
+#                {"pulse": valve, "seconds": seconds}
+#   next         the phase to go to
+#
+# compile_recipe checks a recipe once and turns it into a table indexed by
+# phase number, deciding on a sample then only looks at the current phase.
+
+import json
+import operator
+from collections import namedtuple
+
+CONDITIONS = {
+    'pressure_below': ('pressure', operator.lt),
+    'pressure_above': ('pressure', operator.gt),
+    'temperature_below': ('temperature', operator.lt),
+    'temperature_above': ('temperature', operator.gt),
+}
+ACTIONS = ('open', 'close', 'pulse')
+
+# pulse: Dose or None, dwells: the distinct "after" times at which the
+# transitions have to be tried without waiting for a sample
+Phase = namedtuple('Phase', ['name', 'pulse', 'transitions', 'dwells'])
+# target: pressure to dose to, None for fixed pulses of seconds
+Dose = namedtuple('Dose', ['valve', 'seconds', 'target', 'min_seconds', 'max_seconds', 'settle'])
+# number: index into a run's per transition counters,
+# conditions: (field, operator, threshold, sensor) tuples,
+# lead: seconds or None, actions: (kind, valve, seconds) tuples, next: phase index
+Transition = namedtuple('Transition', ['number', 'conditions', 'lead', 'after', 'times', 'actions', 'next'])
+# filter: PressureTrend keyword arguments, None for raw pressures
+Recipe = namedtuple('Recipe', ['name', 'start', 'phases', 'transition_count', 'filter'])
+
+
+class RecipeError(ValueError):
+    pass
+
+
+def load_recipe(path, valves):
+    # valves: recipe valve name -> valve as passed to the controller's set_valve
+    with open(path) as f:
+        try:
+            recipe = json.load(f)
+        except ValueError as e:
+            raise RecipeError('{}: {}'.format(path, e))
+    return compile_recipe(recipe, valves)
+
+
+def compile_recipe(recipe, valves):
+    phases = recipe.get('phases')
+    if not phases:
+        raise RecipeError('recipe has no phases')
+    names = list(phases)
+    index = {name: i for i, name in enumerate(names)}
+    start = recipe.get('start', names[0])
+    if start not in index:
+        raise RecipeError('start phase {!r} is not defined'.format(start))
+
+    def valve(name, where):
+        if name not in valves:
+            raise RecipeError('{}: unknown valve {!r}'.format(where, name))
+        return valves[name]
+
+    def number(spec, key, where):
+        try:
+            return float(spec[key])
+        except KeyError:
+            raise RecipeError('{}: {} is missing'.format(where, key))
+        except (TypeError, ValueError):
+            raise RecipeError('{}: {} is not a number'.format(where, key))
+
+    compiled = []
+    count = 0
+    for name in names:
+        spec = phases[name]
+        pulse = spec.get('pulse')
+        if pulse is not None:
+            seconds = number(pulse, 'seconds', name)
+            target = number(pulse, 'target', name) if 'target' in pulse else None
+            min_seconds = number(pulse, 'min_seconds', name) if 'min_seconds' in pulse else 0.0
+            max_seconds = number(pulse, 'max_seconds', name) if 'max_seconds' in pulse else seconds
+            settle = number(pulse, 'settle', name) if 'settle' in pulse else 1.0
+            if not 0 < seconds <= max_seconds:
+                raise RecipeError('{}: pulse seconds must be positive and at most max_seconds'.format(name))
+            pulse = Dose(valve(pulse.get('valve'), name), seconds, target, min_seconds, max_seconds, settle)
+        transitions = []
+        for i, t in enumerate(spec.get('transitions', [])):
+            where = '{} transition {}'.format(name, i)
+            when = dict(t.get('when', {}))
+            sensor = int(when.pop('sensor', 0))
+            conditions = []
+            for key in when:
+                if key not in CONDITIONS:
+                    raise RecipeError('{}: unknown condition {!r}'.format(where, key))
+                field, op = CONDITIONS[key]
+                conditions.append((field, op, number(when, key, where), sensor))
+            actions = []
+            for action in t.get('do', []):
+                kinds = [kind for kind in ACTIONS if kind in action]
+                if len(kinds) != 1:
+                    raise RecipeError('{}: an action is one of {}'.format(where, ', '.join(ACTIONS)))
+                kind = kinds[0]
+                seconds = number(action, 'seconds', where) if kind == 'pulse' else None
+                actions.append((kind, valve(action[kind], where), seconds))
+            after = number(t, 'after', where) if 'after' in t else None
+            lead = number(t, 'lead', where) if 'lead' in t else None
+            if lead is not None and recipe.get('filter') is None:
+                raise RecipeError('{}: lead needs a filter'.format(where))
+            times = int(t['times']) if 'times' in t else None
+            if t.get('next') not in index:
+                raise RecipeError('{}: next phase {!r} is not defined'.format(where, t.get('next')))
+            transitions.append(Transition(count, tuple(conditions), lead, after, times,
+                                          tuple(actions), index[t['next']]))
+            count += 1
+        dwells = set(t.after for t in transitions if t.after is not None)
+        if any(t.after is None and not t.conditions for t in transitions):
+            dwells.add(0.0)
+        compiled.append(Phase(name, pulse, tuple(transitions), tuple(sorted(dwells))))
+    trend_filter = recipe.get('filter')
+    if trend_filter is not None:
+        unknown = set(trend_filter) - set(('alpha', 'beta'))
+        if unknown:
+            raise RecipeError('filter: unknown settings {}'.format(', '.join(sorted(unknown))))
+        trend_filter = dict((key, number(trend_filter, key, 'filter')) for key in trend_filter)
+    return Recipe(recipe.get('name', ''), index[start], tuple(compiled), count, trend_filter)
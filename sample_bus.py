@@ -0,0 +1,82 @@
+# Publish/subscribe for sample streams.
+#
+# Every stream (e.g. 'pressure', 'temperatures') keeps only its newest sample
+# in a slot, so control and display always see the freshest reading and
+# memory stays flat however long the run. A consumer that needs every sample,
+# like the log, gets a bounded ring: when it falls behind the oldest samples
+# are dropped and counted instead of the ring growing.
+#
+#   bus = SampleBus()
+#   bus.subscribe('pressure', lambda sample: controller.post_pressure(sample.timestamp, sample.value))
+#   history = bus.ring('pressure', 1000)
+#   bus.publish('pressure', 1.234e-3)        # from the gauge thread
+#   bus.latest('pressure').value
+#   for sample in history.drain(): ...
+#
+# Publishing never waits on a lock: the slot is replaced with one assignment
+# and deque appends are atomic, callbacks run in the publisher's thread and
+# must return quickly. Each stream is meant to have a single publisher.
+
+import time
+from collections import deque, namedtuple
+
+# seq: number of the sample within its stream, counting from 1
+Sample = namedtuple('Sample', ['seq', 'timestamp', 'value'])
+
+
+class Ring(object):
+    # bounded buffer of the latest size samples
+    def __init__(self, size):
+        self._items = deque(maxlen=size)
+        self.dropped = 0  # samples pushed out before they were drained
+
+    def __len__(self):
+        return len(self._items)
+
+    def append(self, item):
+        if len(self._items) == self._items.maxlen:
+            self.dropped += 1
+        self._items.append(item)
+
+    def drain(self):
+        # take everything buffered so far, oldest first
+        items = []
+        try:
+            while True:
+                items.append(self._items.popleft())
+        except IndexError:
+            return items
+
+
+class SampleBus(object):
+    def __init__(self, clock=time):
+        # clock: where timestamps come from when publish is not given one
+        self.clock = clock
+        self._latest = {}       # stream -> Sample
+        self._subscribers = {}  # stream -> tuple of callables(sample)
+        self._rings = {}        # stream -> tuple of Rings
+
+    def publish(self, stream, value, timestamp=None):
+        previous = self._latest.get(stream)
+        sample = Sample(previous.seq + 1 if previous else 1,
+                        self.clock.time() if timestamp is None else timestamp, value)
+        self._latest[stream] = sample
+        for ring in self._rings.get(stream, ()):
+            ring.append(sample)
+        for callback in self._subscribers.get(stream, ()):
+            callback(sample)
+        return sample
+
+    def latest(self, stream):
+        # newest Sample of the stream, None before the first one
+        return self._latest.get(stream)
+
+    def subscribe(self, stream, callback):
+        # callback(sample) runs for every sample published from now on
+        self._subscribers[stream] = self._subscribers.get(stream, ()) + (callback,)
+
+    def ring(self, stream, size=4096):
+        # a Ring receiving every sample published from now on
+        ring = Ring(size)
+        self._rings[stream] = self._rings.get(stream, ()) + (ring,)
+        return ring
@@ -0,0 +1,285 @@
+# Simulated vacuum chamber, for running the control code without hardware.
+#
+#   sim = Simulation(isolation=11, water=10, fdts=9, speed=50)
+#   sim.start()
+#   gauge = Mks901P(sim.port)                    # 901P emulated on a pty
+#   thermometers = DS18B20(base_dir=sim.w1_dir)  # fake w1_slave files
+#   lcd.use_backend(sim.gpio)                    # valves and LCD on a StubGPIO
+#   ...
+#   sim.stop()
+#
+# The chamber pressure follows a simple model: the rough pump pulls it towards
+# base_pressure while the isolation valve is open, the chamber leaks towards
+# atmosphere, and an open source valve lets vapour in towards that source's
+# vapour pressure. The model runs on sim.clock, speed times faster than real
+# time, code that has to keep pace with it takes its time from that clock.
+
+import math
+import os
+import re
+import select
+import shutil
+import tempfile
+import threading
+import time
+import tty
+
+from gpio_stub import StubGPIO
+from mks_901p import command_lookup, e_notation, format_address
+
+ATMOSPHERE = 760.0  # torr
+
+
+class SimClock(object):
+    # same time() and monotonic() as the time module, running speed times
+    # faster than real time
+    def __init__(self, speed=1.0):
+        self.speed = float(speed)
+        self._real_start = time.monotonic()
+        self._wall_start = time.time()
+
+    def monotonic(self):
+        return (time.monotonic() - self._real_start) * self.speed
+
+    def time(self):
+        return self._wall_start + self.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.speed)
+
+
+class Chamber(object):
+    def __init__(self, clock, pump_valve, sources, volume=10.0, pump_speed=2.0,
+                 base_pressure=0.01, leak_rate=1e-3, pressure=ATMOSPHERE,
+                 temperature=22.0, max_step=0.01):
+        # pump_valve: pin of the valve between chamber and pump
+        # sources: pin -> (vapour pressure in torr, conductance in 1/s) of the
+        #          valves that let vapour into the chamber
+        # volume: litres, pump_speed: litres/s, leak_rate: torr/s at vacuum
+        self.clock = clock
+        self.pump_valve = pump_valve
+        self.sources = sources
+        self.pump_rate = pump_speed / volume
+        self.base_pressure = base_pressure
+        self.leak_rate = leak_rate
+        self.temperature = temperature
+        self.max_step = max_step
+        self.open_valves = set()
+        self._pressure = pressure
+        self._time = clock.monotonic()
+        self._lock = threading.Lock()
+
+    def _advance(self):
+        # integrate the model up to now, called with the lock held
+        now = self.clock.monotonic()
+        elapsed = now - self._time
+        steps = int(math.ceil(elapsed / self.max_step))
+        p = self._pressure
+        for _ in range(steps):
+            dt = elapsed / steps
+            rate = self.leak_rate * max(0.0, ATMOSPHERE - p) / ATMOSPHERE
+            if self.pump_valve in self.open_valves:
+                rate -= self.pump_rate * (p - self.base_pressure)
+            for pin in self.open_valves:
+                if pin in self.sources:
+                    vapour_pressure, conductance = self.sources[pin]
+                    rate += conductance * max(0.0, vapour_pressure - p)
+            p = max(self.base_pressure, p + rate * dt)
+        self._pressure = p
+        self._time = now
+
+    def pressure(self):
+        with self._lock:
+            self._advance()
+            return self._pressure
+
+    def valve_changed(self, pin, level):
+        # StubGPIO listener, pins the chamber does not know are ignored
+        if pin != self.pump_valve and pin not in self.sources:
+            return
+        with self._lock:
+            self._advance()
+            if level:
+                self.open_valves.add(pin)
+            else:
+                self.open_valves.discard(pin)
+
+
+# request frames, @<address><command><? or !><value>;FF
+REQUEST_RE = re.compile(rb'@(\d{3})([A-Z]+\d?)([?!])([^;@]*);FF')
+
+
+class GaugeEmulator(object):
+    # answers MKS 901P requests on a pseudo terminal, open self.port with
+    # Mks901P like a real serial port
+    def __init__(self, chamber, address=253, unit='TORR', baud=9600):
+        self.chamber = chamber
+        self.address = address
+        self.baud = baud
+        # replies to every query command, the example responses of the
+        # commands table with the live readings filled in below
+        self.values = {}
+        for entry in command_lookup.values():
+            if entry['Command'].endswith('?;FF'):
+                self.values[entry['Command'][3:-4]] = entry['Response'][7:-3]
+        self.values['U'] = unit
+        self.values['AD'] = format_address(address)
+        self.values['BR'] = str(baud)
+        self.requests = 0
+        # command -> extra seconds before replying to it, a slow transducer
+        self.reply_delays = {}
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def reply_value(self, command):
+        # value for a query, None for commands the transducer does not know
+        p = self.chamber.pressure()
+        if command in ('PR1', 'PR3'):
+            return e_notation(p, 2)
+        if command == 'PR2':
+            # the piezo reads relative to atmosphere
+            return e_notation(p - ATMOSPHERE, 2)
+        if command == 'PR4':
+            return e_notation(p, 3)
+        if command == 'TEM':
+            return e_notation(self.chamber.temperature, 2)
+        return self.values.get(command)
+
+    def handle(self, frame):
+        # reply bytes for one request frame, None when no reply is due
+        m = REQUEST_RE.match(frame)
+        address = int(m.group(1))
+        if address not in (self.address, 254, 255):
+            return None
+        command = m.group(2).decode()
+        value = m.group(4).decode()
+        self.requests += 1
+        if m.group(3) == b'!':
+            if command not in self.values:
+                reply = 'NAK160'
+            else:
+                self.values[command] = value
+                reply = 'ACK' + value
+        else:
+            value = self.reply_value(command)
+            reply = 'NAK160' if value is None else 'ACK' + value
+        if address == 255:
+            # broadcast without reply
+            return None
+        return '@{}{};FF'.format(format_address(self.address), reply).encode()
+
+    def _run(self):
+        buf = bytearray()
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._master], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                buf += os.read(self._master, 1024)
+            except OSError:
+                continue
+            while True:
+                end = buf.find(b';FF')
+                if end == -1:
+                    break
+                start = buf.rfind(b'@', 0, end)
+                frame = bytes(buf[start:end + 3]) if start != -1 else b''
+                del buf[:end + 3]
+                if REQUEST_RE.match(frame):
+                    reply = self.handle(frame)
+                    if reply:
+                        # the reply takes as long as it would on the wire
+                        delay = self.reply_delays.get(REQUEST_RE.match(frame).group(2).decode(), 0.0)
+                        time.sleep(delay + len(reply) * 10.0 / self.baud)
+                        os.write(self._master, reply)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+
+class ThermometerEmulator(object):
+    # keeps fake DS18B20 w1_slave files under directory up to date
+    def __init__(self, chamber, directory, count=2, interval=0.1):
+        self.chamber = chamber
+        self.directory = directory
+        self.interval = interval
+        # sensors sit at slightly different spots, a fixed offset each
+        self.offsets = [0.25 * i for i in range(count)]
+        self._files = []
+        for i in range(count):
+            sensor_dir = os.path.join(directory, '28-{:012x}'.format(0x5151 + i))
+            if not os.path.isdir(sensor_dir):
+                os.makedirs(sensor_dir)
+            fd = os.open(os.path.join(sensor_dir, 'w1_slave'), os.O_RDWR | os.O_CREAT)
+            self._files.append(fd)
+        self._stop = threading.Event()
+        self._thread = None
+        self.update()
+
+    def update(self):
+        for fd, offset in zip(self._files, self.offsets):
+            temp = self.chamber.temperature + offset
+            raw = int(round(temp * 1000))
+            # the sensor's own register holds 1/16 degrees
+            register = int(round(temp * 16)) & 0xFFFF
+            scratchpad = '{:02x} {:02x} 4b 46 7f ff 0c 10 1c'.format(register & 0xFF, register >> 8)
+            # fixed width, each update overwrites the whole file in one write
+            data = '{} : crc=1c YES\n{} t={:06d}\n'.format(scratchpad, scratchpad, raw)
+            os.pwrite(fd, data.encode(), 0)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.update()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for fd in self._files:
+            os.close(fd)
+
+
+class Simulation(object):
+    def __init__(self, isolation, water, fdts, speed=1.0, sensors=2,
+                 water_source=(20.0, 1.0), fdts_source=(10.0, 0.5), **chamber_args):
+        # isolation, water, fdts: GPIO pins of the valves
+        # water_source, fdts_source: (vapour pressure in torr, conductance in 1/s)
+        # chamber_args: passed on to Chamber, e.g. leak_rate
+        self.clock = SimClock(speed)
+        self.chamber = Chamber(self.clock, isolation, {water: water_source, fdts: fdts_source},
+                               **chamber_args)
+        self.gpio = StubGPIO()
+        self.gpio.listeners.append(self.chamber.valve_changed)
+        self.gauge = GaugeEmulator(self.chamber)
+        self.port = self.gauge.port
+        self.w1_dir = tempfile.mkdtemp(prefix='w1_devices_') + os.sep
+        self.thermometers = ThermometerEmulator(self.chamber, self.w1_dir, sensors)
+
+    def start(self):
+        self.gauge.start()
+        self.thermometers.start()
+
+    def stop(self):
+        self.gauge.stop()
+        self.thermometers.stop()
+        shutil.rmtree(self.w1_dir, ignore_errors=True)
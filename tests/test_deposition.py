@@ -0,0 +1,95 @@
+import time
+
+from deposition import DepositionController
+from recipe import compile_recipe
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def post(controller, clock, pressure, dt=0.1):
+    # hand one sample to the controller thread and wait until it is handled
+    count = controller.stats['samples']
+    clock.now += dt
+    controller.post_pressure(time.time(), pressure)
+    deadline = time.monotonic() + 5
+    while controller.stats['samples'] == count and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert controller.stats['samples'] == count + 1
+
+
+def step_recipe(lead=None):
+    transition = {'when': {'pressure_above': 5}, 'next': 'done'}
+    if lead is not None:
+        transition['lead'] = lead
+    return compile_recipe({
+        'filter': {'alpha': 0.3, 'beta': 0.05},
+        'phases': {'dose': {'transitions': [transition]}, 'done': {}},
+    }, {})
+
+
+def test_step_does_not_trigger_pressure_above_early():
+    clock = Clock()
+    controller = DepositionController(step_recipe(), lambda valve, level: None, clock)
+    controller.start()
+    try:
+        for _ in range(20):
+            post(controller, clock, 0.3)
+        for _ in range(100):
+            post(controller, clock, 4.612)
+            assert controller.phase == 'dose'
+        for _ in range(100):
+            post(controller, clock, 5.5)
+            if controller.phase == 'done':
+                break
+        assert controller.phase == 'done'
+    finally:
+        controller.stop()
+
+
+def test_trend_ignores_wall_clock_steps():
+    clock = Clock()
+    controller = DepositionController(step_recipe(), lambda valve, level: None, clock)
+    controller.start()
+    try:
+        for i in range(10):
+            post(controller, clock, 1.0)
+        # a wall clock step between samples leaves the monotonic dt alone
+        count = controller.stats['samples']
+        clock.now += 0.1
+        controller.post_pressure(time.time() - 3600, 1.0)
+        while controller.stats['samples'] == count:
+            time.sleep(0.001)
+        assert controller.trend.time == clock.now
+        assert controller.trend.slope == 0.0
+    finally:
+        controller.stop()
+
+
+def test_lead_holds_once_the_level_is_past_the_threshold():
+    # a slow filter: the average lags well behind a drop that the level has
+    # already followed past the threshold
+    recipe = compile_recipe({
+        'filter': {'alpha': 0.1, 'beta': 0.05},
+        'phases': {
+            'pump_down': {'transitions': [{'when': {'pressure_below': 0.3}, 'lead': 0.2, 'next': 'done'}]},
+            'done': {},
+        },
+    }, {})
+    clock = Clock()
+    controller = DepositionController(recipe, lambda valve, level: None, clock)
+    controller.start()
+    try:
+        for _ in range(20):
+            post(controller, clock, 1.0)
+        post(controller, clock, 0.05)
+        post(controller, clock, 0.05)
+        assert controller.phase == 'done'
+        assert controller.trend.pressure() > 0.3
+    finally:
+        controller.stop()
@@ -0,0 +1,92 @@
+import pytest
+
+from dosing import DoseScheduler, Pulse
+
+
+def learn(scheduler, valve, gain, dead_time, widths, pressure=1.0):
+    for i, seconds in enumerate(widths):
+        after = pressure + gain * max(0.0, seconds - dead_time)
+        scheduler.record(valve, float(i), seconds, pressure, after)
+        pressure = after
+    return pressure
+
+
+def test_probes_until_learnt():
+    scheduler = DoseScheduler()
+    assert scheduler.plan(10, 1.0, 5.5, 0.1, 0.5) == (0.1, None)
+    # the probe is never longer than max_seconds
+    assert scheduler.plan(10, 1.0, 5.5, 1.0, 0.5) == (0.5, None)
+    # a pulse without a settled pressure teaches nothing
+    scheduler.record(10, 0.0, 0.1, 1.0, None)
+    assert scheduler.plan(10, 1.0, 5.5, 0.1, 0.5) == (0.1, None)
+    assert scheduler.stats['plans'] == 3
+
+
+def test_plans_fewest_pulses():
+    scheduler = DoseScheduler()
+    learn(scheduler, 10, 2.0, 0.0, [0.1])
+    assert scheduler.models[10].gain == pytest.approx(2.0)
+    # 0.9 needed at 1.0 per max pulse: one pulse of 0.45 s
+    width, count = scheduler.plan(10, 4.6, 5.5, 0.1, 0.5)
+    assert count == 1 and width == pytest.approx(0.45)
+    # 4.5 needed: five pulses, each 0.45 s rather than four of 0.5 and a short one
+    width, count = scheduler.plan(10, 1.0, 5.5, 0.1, 0.5)
+    assert count == 5 and width == pytest.approx(0.45)
+    # other valves are still unlearnt
+    assert scheduler.plan(9, 1.0, 5.5, 0.2, 2.0) == (0.2, None)
+
+
+def test_nothing_to_do_at_target_or_below_min_seconds():
+    scheduler = DoseScheduler()
+    assert scheduler.plan(10, 5.5, 5.5, 0.1, 0.5) == (0.0, 0)
+    learn(scheduler, 10, 2.0, 0.0, [0.1])
+    assert scheduler.plan(10, 6.0, 5.5, 0.1, 0.5) == (0.0, 0)
+    assert scheduler.plan(10, 5.46, 5.5, 0.1, 0.5, min_seconds=0.05) == (0.0, 0)
+    width, count = scheduler.plan(10, 5.3, 5.5, 0.1, 0.5, min_seconds=0.05)
+    assert count == 1 and width == pytest.approx(0.1)
+
+
+def test_fits_dead_time():
+    scheduler = DoseScheduler()
+    learn(scheduler, 10, 3.0, 0.04, [0.1, 0.2, 0.3, 0.15, 0.25])
+    model = scheduler.models[10]
+    assert model.gain == pytest.approx(3.0)
+    assert model.dead_time == pytest.approx(0.04)
+    width, count = scheduler.plan(10, 5.2, 5.5, 0.1, 0.5)
+    assert count == 1 and width == pytest.approx(0.1 + 0.04)
+
+
+def test_single_width_fits_through_origin():
+    scheduler = DoseScheduler()
+    learn(scheduler, 10, 2.0, 0.0, [0.1, 0.1, 0.1])
+    assert scheduler.models[10].gain == pytest.approx(2.0)
+    assert scheduler.models[10].dead_time == 0.0
+
+
+def test_follows_a_falling_gain():
+    scheduler = DoseScheduler(forget=0.5)
+    learn(scheduler, 10, 4.0, 0.0, [0.1] * 5)
+    learn(scheduler, 10, 1.0, 0.0, [0.1] * 10)
+    assert scheduler.models[10].gain == pytest.approx(1.0, rel=0.01)
+
+
+def test_history_is_bounded():
+    scheduler = DoseScheduler(history=3)
+    learn(scheduler, 10, 2.0, 0.0, [0.1] * 5)
+    assert len(scheduler.history) == 3
+    assert [pulse.time for pulse in scheduler.history] == [2.0, 3.0, 4.0]
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'dosing.json')
+    scheduler = DoseScheduler()
+    learn(scheduler, 10, 3.0, 0.04, [0.1, 0.2, 0.3])
+    scheduler.record(9, 5.0, 0.2, 1.0, None)
+    scheduler.save(path)
+    loaded = DoseScheduler()
+    loaded.load(path)
+    assert list(loaded.history) == list(scheduler.history)
+    assert loaded.history[-1] == Pulse(5.0, 9, 0.2, 1.0, None)
+    assert loaded.models[10].gain == pytest.approx(scheduler.models[10].gain)
+    assert loaded.models[10].dead_time == pytest.approx(scheduler.models[10].dead_time)
+    assert loaded.plan(10, 1.0, 5.5, 0.1, 0.5) == scheduler.plan(10, 1.0, 5.5, 0.1, 0.5)
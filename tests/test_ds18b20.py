@@ -0,0 +1,68 @@
+import os
+import shutil
+
+import pytest
+
+from ds18b20 import DS18B20, FAILED, GOOD, STALE
+from sim import Chamber, SimClock, ThermometerEmulator
+
+
+@pytest.fixture
+def sensors(tmp_path):
+    chamber = Chamber(SimClock(), 11, {}, temperature=22.0)
+    ThermometerEmulator(chamber, str(tmp_path), count=2)
+    thermometers = DS18B20(base_dir=str(tmp_path) + os.sep, rescan_interval=0)
+    yield thermometers
+    thermometers.close()
+
+
+def test_latest_before_sampling(sensors):
+    assert sensors.latest(0).quality == FAILED
+    with pytest.raises(RuntimeError):
+        sensors.wait_for_sample(timeout=0.1)
+
+
+def test_sampling(sensors):
+    sensors.start_sampling(interval=0.01)
+    seq = sensors.wait_for_sample(0, timeout=5)
+    assert seq >= 1
+    readings = sensors.latest_all()
+    assert [r.quality for r in readings] == [GOOD, GOOD]
+    assert [r.value for r in readings] == [22.0, 22.25]
+    assert sensors.wait_for_sample(seq, timeout=5) > seq
+
+
+def test_start_sampling_twice(sensors):
+    sensors.start_sampling(interval=0.01)
+    with pytest.raises(RuntimeError):
+        sensors.start_sampling()
+
+
+def plug(directory, rom_id, temp):
+    # a sensor directory as the w1_therm driver shows it
+    os.makedirs(os.path.join(directory, rom_id))
+    line = '72 01 4b 46 7f ff 0e 10 57'
+    with open(os.path.join(directory, rom_id, 'w1_slave'), 'w') as f:
+        f.write('{} : crc=57 YES\n{} t={:d}\n'.format(line, line, int(temp * 1000)))
+
+
+def test_sensors_keep_their_index_across_rescans(tmp_path, sensors):
+    first, second = sensors.rom_ids()
+    sensors.start_sampling(interval=0.01)
+    seq = sensors.wait_for_sample(0, timeout=5)
+    # a new probe that sorts first and the first probe unplugged
+    plug(str(tmp_path), '28-000000000001', 30.0)
+    shutil.rmtree(str(tmp_path / first))
+    sensors._rescan()
+    seq = sensors.wait_for_sample(sensors.wait_for_sample(seq, timeout=5), timeout=5)
+    assert sensors.rom_ids() == [first, second, '28-000000000001']
+    readings = sensors.latest_all()
+    assert [r.quality for r in readings] == [STALE, GOOD, GOOD]
+    assert [r.value for r in readings] == [22.0, 22.25, 30.0]
+    # plugged back in, it goes back to its own column
+    plug(str(tmp_path), first, 23.0)
+    sensors._rescan()
+    sensors.wait_for_sample(sensors.wait_for_sample(seq, timeout=5), timeout=5)
+    assert sensors.rom_ids() == [first, second, '28-000000000001']
+    assert [r.value for r in sensors.latest_all()] == [23.0, 22.25, 30.0]
+    assert sensors.device_count() == 3
@@ -0,0 +1,51 @@
+import lcd
+from gpio_stub import StubGPIO
+
+
+def attach(monkeypatch):
+    # a stub display recording E pulses and lcd's waits in order
+    gpio = StubGPIO()
+    display = gpio.attach_lcd(lcd.LCD_RS, lcd.LCD_E, lcd.LCD_DATA)
+    events = []
+    clock = display.clock
+
+    def record(levels):
+        events.append(('nibble', bool(levels.get(lcd.LCD_RS)),
+                       sum(1 << bit for bit, pin in enumerate(lcd.LCD_DATA) if levels.get(pin))))
+        clock(levels)
+    display.clock = record
+    monkeypatch.setattr(lcd, '_wait', lambda seconds: events.append(('wait', seconds)))
+    monkeypatch.setattr(lcd.time, 'sleep', lambda seconds: events.append(('wait', seconds)))
+    lcd.use_backend(gpio)
+    return gpio, display, events
+
+
+def test_init_sends_the_8_bit_nibbles_with_their_own_delays(monkeypatch):
+    gpio, display, events = attach(monkeypatch)
+    lcd.setup_gpio()
+    # drop the enable pulse widths, they are not instruction delays
+    events = [e for e in events if e != ('wait', lcd.E_PULSE)]
+    assert events[0][0] == 'wait' and events[0][1] >= 0.040
+    assert events[1:9] == [
+        ('nibble', False, 0x3), ('wait', lcd.INIT_DELAY),
+        ('nibble', False, 0x3), ('wait', lcd.INIT_SHORT_DELAY),
+        ('nibble', False, 0x3), ('wait', lcd.E_DELAY),
+        ('nibble', False, 0x2), ('wait', lcd.E_DELAY),
+    ]
+    assert lcd.INIT_DELAY >= 0.0041 and lcd.INIT_SHORT_DELAY >= 0.0001
+    assert display.four_bit
+
+
+def test_text_after_init(monkeypatch):
+    gpio, display, events = attach(monkeypatch)
+    lcd.setup_gpio()
+    lcd.lcd_text('Hello', lcd.LCD_LINE_1)
+    lcd.lcd_text('1.234E-03 TORR', lcd.LCD_LINE_2)
+    assert display.line(lcd.LCD_LINE_1 & 0x7F) == 'Hello'.ljust(16)
+    assert display.line(lcd.LCD_LINE_2 & 0x7F) == '1.234E-03 TORR'.ljust(16)
+    # only changed cells are written again
+    writes = gpio.writes
+    lcd.lcd_text('Hellp', lcd.LCD_LINE_1)
+    assert display.line(lcd.LCD_LINE_1 & 0x7F) == 'Hellp'.ljust(16)
+    # a DDRAM address and a character, 6 output calls each
+    assert gpio.writes - writes == 12
@@ -0,0 +1,27 @@
+import json
+
+from ds18b20 import DS18B20
+from main_system_control import ISOLATION, FDTS, WATER, VacuumSystem
+from mks_901p import Mks901P
+from sim import Simulation
+
+
+def test_run_returns_once_the_recipe_is_done(tmp_path):
+    recipe = tmp_path / 'pump_down.json'
+    recipe.write_text(json.dumps({'phases': {
+        'pump_down': {'transitions': [{'when': {'pressure_below': 100}, 'next': 'done'}]},
+        'done': {},
+    }}))
+    sim = Simulation(ISOLATION, WATER, FDTS, speed=50)
+    sim.start()
+    try:
+        system = VacuumSystem(sim.gpio, Mks901P(sim.port), DS18B20(base_dir=sim.w1_dir),
+                              str(recipe), str(tmp_path / 'pressure_log_'), sim.clock, 50)
+        system.run()
+    finally:
+        sim.stop()
+    assert system.controller.phase == 'done'
+    assert system.readers and not any(t.is_alive() for t in system.readers)
+    assert not system.lcd_renderer._thread.is_alive()
+    assert not system.log_writer._thread.is_alive()
+    assert system.log_writer.stats['records'] > 0
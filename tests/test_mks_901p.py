@@ -0,0 +1,231 @@
+import os
+import threading
+import time
+
+import pytest
+
+from mks_901p import (Mks901P, Mks901PError, Mks901PNak, Mks901PTimeout, NO_RETRY, RateStats,
+                      RetryPolicy, UnrecognizedMessage, ValueOutOfRange, check_reply, compiled_commands,
+                      pop_reply)
+from sim import Chamber, GaugeEmulator, SimClock
+
+
+def test_pop_reply_returns_frames_in_order():
+    buf = bytearray(b'@253ACK1.23E-3;FF@001NAK160;FF@253AC')
+    assert pop_reply(buf) == (253, True, b'1.23E-3')
+    assert pop_reply(buf) == (1, False, b'160')
+    # the partial frame stays for the next read
+    assert pop_reply(buf) is None
+    assert buf == bytearray(b'@253AC')
+    buf += b'K760;FF'
+    assert pop_reply(buf) == (253, True, b'760')
+    assert buf == bytearray()
+
+
+def test_pop_reply_skips_garbage():
+    buf = bytearray(b'\x00\xff;FFnoise@253ACK7.60E+2;FF')
+    assert pop_reply(buf) == (253, True, b'7.60E+2')
+    buf = bytearray(b'@25XACK1;FF')
+    assert pop_reply(buf) is None
+    assert buf == bytearray()
+
+
+def new_stats():
+    return {'timeouts': 0, 'naks': 0}
+
+
+def test_check_reply_accepts_an_ack():
+    stats = new_stats()
+    assert check_reply((253, True, b'1.0E+0'), b'@253PR1?;FF', 253, stats) is None
+    # any transducer may answer a broadcast
+    assert check_reply((1, True, b'1.0E+0'), b'@254PR1?;FF', 254, stats) is None
+    assert stats == new_stats()
+
+
+def test_check_reply_errors():
+    stats = new_stats()
+    assert isinstance(check_reply(None, b'@253PR1?;FF', 253, stats), Mks901PTimeout)
+    error = check_reply((1, True, b'1.0E+0'), b'@253PR1?;FF', 253, stats)
+    assert type(error) is Mks901PError
+    error = check_reply((253, False, b'172'), b'@253SP1!2E+3;FF', 253, stats)
+    assert isinstance(error, ValueOutOfRange)
+    assert error.code == 172 and error.command == b'@253SP1!2E+3;FF'
+    # codes without an exception of their own are plain NAKs
+    error = check_reply((253, False, b'999'), b'@253PR1?;FF', 253, stats)
+    assert type(error) is Mks901PNak and error.error == 'Unknown NAK code'
+    error = check_reply((253, False, b'x'), b'@253PR1?;FF', 253, stats)
+    assert type(error) is Mks901PError
+    assert stats == {'timeouts': 1, 'naks': 3}
+
+
+def test_retry_policy():
+    retry = RetryPolicy(retries=2, backoff=0.1, max_backoff=0.15)
+    timeout = Mks901PTimeout('no reply')
+    assert retry.budget_end(10.0) is None
+    assert retry.wait_after(timeout, 0, 0.0, None) == 0.1
+    assert retry.wait_after(UnrecognizedMessage(160), 1, 0.0, None) == 0.15
+    with pytest.raises(Mks901PTimeout):
+        retry.wait_after(timeout, 2, 0.0, None)
+    # a NAK other than a garbled frame is the transducer's answer, no retry
+    with pytest.raises(ValueOutOfRange):
+        retry.wait_after(ValueOutOfRange(172), 0, 0.0, None)
+    budgeted = RetryPolicy(retries=5, backoff=0.1, budget=1.0)
+    assert budgeted.budget_end(10.0) == 11.0
+    assert budgeted.wait_after(timeout, 0, 10.5, 11.0) == 0.1
+    with pytest.raises(Mks901PTimeout):
+        budgeted.wait_after(timeout, 0, 10.95, 11.0)
+
+
+def test_rate_stats():
+    stats = RateStats()
+    assert stats.summary() == '0 samples'
+    for t in (0.0, 0.1, 0.2, 0.3, 0.5):
+        stats.add(t)
+    assert stats.rate() == pytest.approx(8.0)
+    assert stats.min_interval == pytest.approx(0.1)
+    assert stats.max_interval == pytest.approx(0.2)
+    assert stats.jitter() == pytest.approx(0.05)
+
+
+@pytest.fixture
+def gauge():
+    emulator = GaugeEmulator(Chamber(SimClock(), 11, {}, pressure=1.0), baud=115200)
+    emulator.start()
+    mks = Mks901P(emulator.port, baud=115200, timeout=0.2, retry=NO_RETRY)
+    yield emulator, mks
+    mks.serial_port.close()
+    emulator.stop()
+
+
+def test_query_many(gauge):
+    emulator, mks = gauge
+    result = mks.query_many(['pirani', 'get_pressure_unit', 'combined_4_digit'])
+    assert result == {'pirani': 1.0, 'get_pressure_unit': 'TORR', 'combined_4_digit': 1.0}
+
+
+def test_late_broadcast_reply_is_not_taken_for_the_next_one(gauge):
+    emulator, mks = gauge
+    emulator.chamber._pressure = 2.0
+    # the pirani reply comes after its timeout, during the next query
+    emulator.reply_delays['PR1'] = 0.3
+    result = mks.query_many(['pirani', 'get_pressure_unit'])
+    assert result == {'pirani': None, 'get_pressure_unit': 'TORR'}
+    assert isinstance(mks.last_errors['pirani'], Mks901PTimeout)
+    assert mks.stats['late_replies'] == 1
+    del emulator.reply_delays['PR1']
+    assert mks.query('pirani') == 2.0
+
+
+def test_pipelined_burst_falls_back_after_a_missing_reply(gauge):
+    emulator, mks = gauge
+    emulator.reply_delays['PR4'] = 0.3
+    result = mks.query_many(['get_pressure_unit', 'combined_4_digit', 'pirani'], pipeline=True)
+    assert result['get_pressure_unit'] == 'TORR'
+    assert result['combined_4_digit'] is None
+    assert result['pirani'] == 1.0
+
+
+def test_queries_leave_the_port_settings_alone(gauge):
+    emulator, mks = gauge
+    port = mks.serial_port
+    reconfigure = port._reconfigure_port
+    calls = []
+
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return reconfigure(*args, **kwargs)
+    port._reconfigure_port = counting
+    for _ in range(5):
+        assert mks.query('pirani', timeout=0.3) == 1.0
+    with pytest.raises(Mks901PTimeout):
+        mks.query('pirani', address=7, timeout=0.05)
+    assert calls == []
+
+
+def test_missing_addresses_cost_one_timeout_each(gauge):
+    emulator, mks = gauge
+    started = time.monotonic()
+    for address in range(1, 6):
+        with pytest.raises(Mks901PTimeout):
+            mks.query('get_address', address, timeout=0.1)
+    # no waiting for late replies, addressed ones are told apart by address
+    assert time.monotonic() - started < 0.8
+    assert mks.query('get_address', 253) == 253
+
+
+def test_addressed_request_drops_replies_from_other_addresses(gauge):
+    emulator, mks = gauge
+    emulator.reply_delays['PR1'] = 0.1
+
+    def stray():
+        time.sleep(0.03)
+        os.write(emulator._master, b'@007ACK9.99E+2;FF')
+    thread = threading.Thread(target=stray)
+    thread.start()
+    assert mks.query('pirani', 253, timeout=0.5) == 1.0
+    thread.join()
+    assert mks.stats['late_replies'] == 1
+
+
+def test_set_command_frames():
+    assert compiled_commands['set_setpoint_1'].frame(253, 20.0) == b'@253SP1!2.00E+1;FF'
+    assert compiled_commands['set_setpoint_1'].frame(1, 1.5e-3) == b'@001SP1!1.50E-3;FF'
+    assert compiled_commands['set_address'].frame(253, 5) == b'@253AD!005;FF'
+    assert compiled_commands['enable_setpoint_1'].frame(253, True) == b'@253EN1!ON;FF'
+    assert compiled_commands['enable_setpoint_1'].frame(253, False) == b'@253EN1!OFF;FF'
+    assert compiled_commands['enable_setpoint_1'].frame(253, 'off') == b'@253EN1!OFF;FF'
+    assert compiled_commands['set_baud_rate'].frame(253, 19200) == b'@253BR!19200;FF'
+    assert compiled_commands['set_pressure_unit'].frame(253, 'mbar') == b'@253U!MBAR;FF'
+    assert compiled_commands['set_user_tag'].frame(253, 'LoadLock') == b'@253UT!LoadLock;FF'
+    assert compiled_commands['get_setpoint_1'].frame(7) == b'@007SP1?;FF'
+
+
+def test_set_command_rejects_bad_values():
+    with pytest.raises(ValueError):
+        compiled_commands['set_baud_rate'].frame(253, 1234)
+    with pytest.raises(ValueError):
+        compiled_commands['enable_setpoint_1'].frame(253, 'maybe')
+    # the example value in the table is never sent by accident
+    with pytest.raises(ValueError):
+        compiled_commands['set_setpoint_1'].frame(253)
+
+
+def test_perform_frames_default_to_the_reference_value():
+    assert compiled_commands['perform_pirani_zero_adjustment'].frame(253) == b'@253VAC!;FF'
+    assert compiled_commands['perform_pirani_atmosphere_adjustment'].frame(253) == b'@253ATM!7.60E+2;FF'
+    assert compiled_commands['perform_pirani_atmosphere_adjustment'].frame(253, 750.0) == b'@253ATM!7.50E+2;FF'
+    assert compiled_commands['perform_piezo_differential_adjustment'].frame(253) == b'@253ATZ;FF'
+
+
+def test_reply_converters():
+    assert compiled_commands['get_setpoint_1'].convert(b'1.00E-2') == 1e-2
+    assert compiled_commands['get_setpoint_1_status'].convert(b'SET') is True
+    assert compiled_commands['get_setpoint_1_status'].convert(b'CLEAR') is False
+    assert compiled_commands['get_switch'].convert(b'ON') is True
+    assert compiled_commands['get_address'].convert(b'005') == 5
+    assert compiled_commands['get_time_on'].convert(b'12345') == 12345
+    assert compiled_commands['get_pressure_unit'].convert(b'TORR') == 'TORR'
+    with pytest.raises(ValueError):
+        compiled_commands['get_setpoint_1'].convert(b'junk')
+
+
+def test_generated_methods_send_the_frames(monkeypatch):
+    frames = []
+
+    def transact(self, frame, address, timeout=None, retry=None):
+        frames.append((frame, address))
+        # the transducer acknowledges a set with the value it took
+        value = frame[:-3].split(b'!')[1] if b'!' in frame else b'1.00E+0'
+        return (address, True, value)
+    monkeypatch.setattr(Mks901P, '_transact', transact)
+    mks = Mks901P.__new__(Mks901P)
+    mks.serial_port = True
+    assert mks.set_setpoint_1(20.0) == 20.0
+    assert mks.set_address(5, address=253) == 5
+    assert mks.enable_setpoint_1(True) is True
+    assert mks.perform_pirani_zero_adjustment() == ''
+    assert mks.get_pressure_pirani(address=3) == 1.0
+    with pytest.raises(ValueError):
+        mks.set_baud_rate(1234)
+    assert frames == [(b'@254SP1!2.00E+1;FF', 254), (b'@253AD!005;FF', 253), (b'@254EN1!ON;FF', 254),
+                      (b'@254VAC!;FF', 254), (b'@003PR1?;FF', 3)]
@@ -0,0 +1,72 @@
+import asyncio
+import os
+
+import pytest
+
+from mks_901p import NO_RETRY, Mks901PTimeout
+from sim import Chamber, GaugeEmulator, SimClock
+
+serial_asyncio = pytest.importorskip('serial_asyncio')
+from mks_901p_async import AsyncMks901P
+
+
+@pytest.fixture
+def emulator():
+    emulator = GaugeEmulator(Chamber(SimClock(), 11, {}, pressure=1.0), baud=115200)
+    emulator.start()
+    yield emulator
+    emulator.stop()
+
+
+def run(emulator, session):
+    # session: coroutine function taking a connected AsyncMks901P
+    async def main():
+        mks = await AsyncMks901P.open(emulator.port, baud=115200, timeout=0.2, retry=NO_RETRY)
+        try:
+            return await session(mks)
+        finally:
+            mks.close()
+    return asyncio.run(main())
+
+
+def test_round_trip(emulator):
+    async def session(mks):
+        pressure = await mks.get_pressure_combined_4_digit()
+        config = await mks.configure({'set_setpoint_1': 20.0, 'enable_setpoint_1': True})
+        many = await mks.query_many(['pirani', 'get_pressure_unit', 'get_setpoint_1', (253, 'get_address')])
+        return pressure, config, many, mks.stats
+    pressure, config, many, stats = run(emulator, session)
+    assert pressure == pytest.approx(1.0, rel=0.01)
+    assert config == {'set_setpoint_1': 20.0, 'enable_setpoint_1': True}
+    assert emulator.values['SP1'] == '2.00E+1' and emulator.values['EN1'] == 'ON'
+    assert many['get_pressure_unit'] == 'TORR'
+    assert many['get_setpoint_1'] == 20.0
+    assert many[(253, 'get_address')] == 253
+    assert stats['requests'] == 7 and stats['timeouts'] == 0
+
+
+def test_late_broadcast_reply_is_not_taken_for_the_next_one(emulator):
+    emulator.chamber._pressure = 2.0
+    emulator.reply_delays['PR1'] = 0.3
+
+    async def session(mks):
+        result = await mks.query_many(['pirani', 'get_pressure_unit'])
+        return result, mks.last_errors, mks.stats
+    result, errors, stats = run(emulator, session)
+    assert result == {'pirani': None, 'get_pressure_unit': 'TORR'}
+    assert isinstance(errors['pirani'], Mks901PTimeout)
+    assert stats['late_replies'] == 1
+
+
+def test_addressed_request_drops_replies_from_other_addresses(emulator):
+    emulator.reply_delays['PR1'] = 0.1
+
+    async def session(mks):
+        async def stray():
+            await asyncio.sleep(0.03)
+            os.write(emulator._master, b'@007ACK9.99E+2;FF')
+        pressure, _ = await asyncio.gather(mks.query('pirani', 253), stray())
+        return pressure, mks.stats
+    pressure, stats = run(emulator, session)
+    assert pressure == pytest.approx(1.0, rel=0.01)
+    assert stats['late_replies'] == 1
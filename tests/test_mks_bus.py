@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+
+from mks_901p import Mks901P, NO_RETRY
+from mks_bus import BusPoller
+from sim import Chamber, GaugeEmulator, SimClock
+
+
+@pytest.fixture
+def gauge():
+    emulator = GaugeEmulator(Chamber(SimClock(), 11, {}, pressure=1.0), baud=115200)
+    emulator.start()
+    mks = Mks901P(emulator.port, baud=115200, timeout=0.2, retry=NO_RETRY)
+    yield emulator, mks
+    mks.serial_port.close()
+    emulator.stop()
+
+
+def stop_within(poller, seconds):
+    # poller.stop() in a thread of its own, a hung stop fails instead of hanging the tests
+    stopper = threading.Thread(target=poller.stop)
+    stopper.daemon = True
+    stopper.start()
+    stopper.join(seconds)
+    return not stopper.is_alive()
+
+
+def test_discover(gauge):
+    emulator, mks = gauge
+    assert BusPoller(mks).discover([5, 253, 6]) == [253]
+
+
+def test_stop_with_a_job_always_due(gauge):
+    emulator, mks = gauge
+    poller = BusPoller(mks)
+    # faster than the gauge can answer, there is always a job due
+    poller.add(253, 'combined_4_digit', 1000)
+    poller.start()
+    time.sleep(0.2)
+    assert stop_within(poller, 1.0)
+    assert poller.latest[(253, 'combined_4_digit')][1] == pytest.approx(1.0, rel=0.1)
+    assert poller.missed[(253, 'combined_4_digit')] > 0
+
+
+def test_offline_address_does_not_starve_the_others(gauge):
+    emulator, mks = gauge
+    samples = []
+    poller = BusPoller(mks, lambda address, key, value, timestamp: samples.append((address, value)))
+    poller.add(253, 'combined_4_digit', 20)
+    poller.add(6, 'combined_4_digit', 5)
+    poller.start()
+    time.sleep(1.0)
+    assert stop_within(poller, 1.0)
+    assert len(samples) >= 15
+    assert set(address for address, _ in samples) == set([253])
+    assert poller.missed[(253, 'combined_4_digit')] <= 2
+    # polled less often the longer it does not answer
+    assert 1 <= poller.errors[(6, 'combined_4_digit')] <= 4
+    assert poller.failures == {253: 0, 6: poller.errors[(6, 'combined_4_digit')]}
@@ -0,0 +1,99 @@
+import errno
+
+import numpy as np
+import pytest
+
+from pressure_log import LogArchive, LogCommitter, LogWriteError, RotatingLogWriter, log_files
+
+
+def test_committer_writes_everything(tmp_path):
+    log = RotatingLogWriter(str(tmp_path / 'log_'), 'TORR', ['28-a'], buffering=0)
+    committer = LogCommitter(log, sync_interval=0.01)
+    committer.start()
+    for i in range(1000):
+        committer.put(float(i), 1e-3, (20.0,), 4)
+    committer.stop()
+    log.close()
+    assert committer.error is None
+    assert committer.stats['records'] == 1000
+    assert committer.stats['dropped'] == committer.stats['lost'] == 0
+
+
+def test_committer_reports_a_failed_sync(tmp_path, monkeypatch):
+    log = RotatingLogWriter(str(tmp_path / 'log_'), 'TORR', [], buffering=0)
+
+    def sync():
+        raise OSError(errno.ENOSPC, 'No space left on device')
+    monkeypatch.setattr(log, 'sync', sync)
+    committer = LogCommitter(log, sync_interval=0.0)
+    committer.start()
+    committer.put(1.0, 1e-3)
+    committer._thread.join(5)
+    assert not committer._thread.is_alive()
+    assert isinstance(committer.error, OSError)
+    assert committer.stats['lost'] == 1
+    with pytest.raises(LogWriteError):
+        committer.put(2.0, 1e-3)
+    with pytest.raises(LogWriteError) as raised:
+        committer.stop()
+    assert raised.value.__cause__ is committer.error
+
+
+def write_log(prefix, times, sensors=1, **args):
+    log = RotatingLogWriter(prefix, 'TORR', ['28-{}'.format(i) for i in range(sensors)], **args)
+    for t in times:
+        pressure = None if t % 50 == 7 else 1e-3 * (1 + t % 10)
+        log.append(float(t), pressure, [20.0 + i for i in range(sensors)], int(t) % 8)
+    log.close()
+
+
+def test_rotation_and_index(tmp_path):
+    prefix = str(tmp_path / 'log_')
+    write_log(prefix, range(1000), chunk_records=64, max_seconds=300)
+    assert sorted(log_files(prefix)) == [0, 1, 2, 3]
+    archive = LogArchive(prefix)
+    entries = archive.read_index()
+    assert [t for t, _, _ in entries][:3] == [0.0, 64.0, 128.0]
+    assert len(set(name for _, name, _ in entries)) == 4
+    records = archive.query()
+    assert list(records['time']) == list(range(1000))
+    assert records['valves'][13] == 5
+    assert np.isnan(records['pressure'][57])
+
+
+def test_query_time_range(tmp_path):
+    prefix = str(tmp_path / 'log_')
+    write_log(prefix, range(1000), chunk_records=64, max_seconds=300)
+    archive = LogArchive(prefix)
+    # across a file boundary, both ends included
+    records = archive.query(250.0, 350.0)
+    assert list(records['time']) == list(range(250, 351))
+    assert list(archive.query(998.5)['time']) == [999.0]
+    assert len(archive.query(2000.0)) == 0
+    assert list(archive.query(end=3.0)['time']) == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_query_downsample(tmp_path):
+    prefix = str(tmp_path / 'log_')
+    write_log(prefix, range(100), chunk_records=16)
+    result = LogArchive(prefix).query(0.0, 99.0, downsample=10)
+    assert list(result['time']) == [float(t) for t in range(0, 100, 10)]
+    assert list(result['count']) == [10] * 10
+    assert result['pressure_min'][0] == pytest.approx(1e-3)
+    assert result['pressure_max'][0] == pytest.approx(1e-2)
+    # the NaN at t = 7 is left out of its bucket's mean
+    assert result['pressure_mean'][0] == pytest.approx(np.mean([1e-3 * (1 + t) for t in range(10) if t != 7]))
+    assert result['pressure_mean'][1] == pytest.approx(5.5e-3)
+    assert result['temps_mean'][:, 0] == pytest.approx([20.0] * 10)
+    empty = LogArchive(prefix).query(500.0, 600.0, downsample=10)
+    assert len(empty['time']) == len(empty['pressure_mean']) == 0
+
+
+def test_query_spans_files_with_more_sensors(tmp_path):
+    prefix = str(tmp_path / 'log_')
+    write_log(prefix, range(10), sensors=1)
+    write_log(prefix, range(10, 20), sensors=2)
+    records = LogArchive(prefix).query()
+    assert records['temps'].shape == (20, 2)
+    assert np.isnan(records['temps'][:10, 1]).all()
+    assert list(records['temps'][15]) == [20.0, 21.0]
@@ -0,0 +1,95 @@
+import operator
+import os
+
+import pytest
+
+from recipe import Dose, RecipeError, compile_recipe, load_recipe
+
+valves = {'water': 10, 'fdts': 9, 'isolation': 11}
+
+
+def recipe(**phases):
+    return {'name': 'test', 'start': 'a', 'phases': phases}
+
+
+def test_compiles_phases_and_transitions():
+    compiled = compile_recipe({
+        'name': 'test',
+        'start': 'b',
+        'filter': {'alpha': 0.3, 'beta': '0.05'},
+        'phases': {
+            'a': {'pulse': {'valve': 'water', 'seconds': 0.1},
+                  'transitions': [
+                      {'when': {'pressure_above': 5, 'temperature_below': '30', 'sensor': 1},
+                       'lead': 0.2, 'do': [{'close': 'water'}, {'pulse': 'fdts', 'seconds': 0.5}],
+                       'next': 'b'},
+                      {'after': 10, 'times': 2, 'next': 'a'},
+                  ]},
+            'b': {'pulse': {'valve': 'fdts', 'seconds': 0.2, 'target': 5.5, 'max_seconds': 2},
+                  'transitions': [{'next': 'a'}, {'after': 3, 'when': {'pressure_below': 1}, 'next': 'a'}]},
+            'done': {},
+        },
+    }, valves)
+    assert compiled.name == 'test'
+    assert compiled.start == 1
+    assert compiled.transition_count == 4
+    assert compiled.filter == {'alpha': 0.3, 'beta': 0.05}
+    a, b, done = compiled.phases
+    assert a.pulse == Dose(10, 0.1, None, 0.0, 0.1, 1.0)
+    assert b.pulse == Dose(9, 0.2, 5.5, 0.0, 2.0, 1.0)
+    first, second = a.transitions
+    assert first.number == 0
+    assert sorted(first.conditions) == sorted([('pressure', operator.gt, 5.0, 1),
+                                               ('temperature', operator.lt, 30.0, 1)])
+    assert first.lead == 0.2
+    assert first.actions == (('close', 10, None), ('pulse', 9, 0.5))
+    assert first.next == 1
+    assert (second.after, second.times, second.next) == (10.0, 2, 0)
+    assert a.dwells == (10.0,)
+    # a transition without conditions or after is due straight away
+    assert b.dwells == (0.0, 3.0)
+    assert [t.number for t in b.transitions] == [2, 3]
+    assert done.pulse is None and done.transitions == () and done.dwells == ()
+
+
+def test_start_defaults_to_the_first_phase():
+    compiled = compile_recipe({'phases': {'x': {'transitions': [{'next': 'y'}]}, 'y': {}}}, valves)
+    assert compiled.start == 0
+    assert compiled.filter is None
+
+
+def test_shipped_recipe_loads():
+    path = os.path.join(os.path.dirname(__file__), '..', 'recipes', 'fdts.json')
+    compiled = load_recipe(path, valves)
+    assert compiled.phases
+
+
+@pytest.mark.parametrize('spec', [
+    {'phases': {}},
+    {'start': 'missing', 'phases': {'a': {}}},
+    recipe(a={'pulse': {'valve': 'nitrogen', 'seconds': 0.1}}),
+    recipe(a={'pulse': {'valve': 'water'}}),
+    recipe(a={'pulse': {'valve': 'water', 'seconds': 'long'}}),
+    recipe(a={'pulse': {'valve': 'water', 'seconds': 1, 'max_seconds': 0.5}}),
+    recipe(a={'pulse': {'valve': 'water', 'seconds': 0}}),
+    recipe(a={'transitions': [{'when': {'pressure_near': 1}, 'next': 'a'}]}),
+    recipe(a={'transitions': [{'when': {'pressure_below': None}, 'next': 'a'}]}),
+    recipe(a={'transitions': [{'next': 'b'}]}),
+    recipe(a={'transitions': [{'do': [{'open': 'water', 'close': 'fdts'}], 'next': 'a'}]}),
+    recipe(a={'transitions': [{'do': [{'vent': 'water'}], 'next': 'a'}]}),
+    recipe(a={'transitions': [{'do': [{'pulse': 'water'}], 'next': 'a'}]}),
+    recipe(a={'transitions': [{'do': [{'open': 'nitrogen'}], 'next': 'a'}]}),
+    recipe(a={'transitions': [{'when': {'pressure_below': 1}, 'lead': 0.2, 'next': 'a'}]}),
+    dict(recipe(a={}), filter={'alpha': 0.3, 'gamma': 1}),
+    dict(recipe(a={}), filter={'alpha': 'fast'}),
+])
+def test_rejects_bad_recipes(spec):
+    with pytest.raises(RecipeError):
+        compile_recipe(spec, valves)
+
+
+def test_load_reports_bad_json(tmp_path):
+    path = tmp_path / 'bad.json'
+    path.write_text('{"phases": ')
+    with pytest.raises(RecipeError, match='bad.json'):
+        load_recipe(str(path), valves)
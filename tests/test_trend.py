@@ -0,0 +1,74 @@
+import math
+
+from trend import PressureTrend, INFINITY
+
+
+def test_first_sample_sets_level():
+    trend = PressureTrend()
+    assert trend.pressure() is None
+    assert trend.time_to(1.0) is None
+    trend.update(0.0, 2.0)
+    assert trend.pressure() == 2.0
+    assert trend.time_to(1.0) == INFINITY
+
+
+def test_skips_bad_samples():
+    trend = PressureTrend()
+    trend.update(0.0, 1.0)
+    trend.update(1.0, None)
+    trend.update(2.0, 0.0)
+    trend.update(2.0, -1.0)
+    trend.update(-0.5, 5.0)
+    assert trend.samples == 1
+    assert trend.pressure() == 1.0
+
+
+def test_step_does_not_overshoot():
+    trend = PressureTrend(alpha=0.3, beta=0.05)
+    t = 0.0
+    for _ in range(20):
+        trend.update(t, 0.3)
+        t += 0.1
+    for _ in range(50):
+        trend.update(t, 4.612)
+        t += 0.1
+        assert trend.pressure() <= 4.612 + 1e-9
+        assert math.exp(trend.level) <= 4.612 + 1e-9
+
+
+def test_exponential_pump_down_predicts_crossing():
+    trend = PressureTrend(alpha=0.5, beta=0.2)
+    t = 0.0
+    while t < 20:
+        trend.update(t, 100.0 * math.exp(-t / 5.0))
+        t += 0.1
+    # still tracking tau = 5 s, 0.3 torr is 5 * ln(100 / 0.3) s from the start
+    assert abs(trend.slope + 0.2) < 0.01
+    expected = 5.0 * math.log(100.0 / 0.3) - trend.time
+    assert abs(trend.time_to(0.3) - expected) < 0.5
+    assert trend.rate() < 0
+    assert trend.time_to(1000.0) == INFINITY
+
+
+def test_time_to_is_zero_past_the_target():
+    trend = PressureTrend(alpha=0.5, beta=0.2)
+    t = 0.0
+    while t < 40:
+        p = 100.0 * math.exp(-t / 5.0)
+        trend.update(t, p)
+        t += 0.1
+    # well below 0.3 torr and still falling
+    assert trend.pressure() < 0.05
+    assert trend.time_to(0.3) == INFINITY
+    assert trend.time_to(0.3, below=True) == 0.0
+    assert trend.time_to(0.3, below=False) == INFINITY
+    assert trend.time_to(1e-3, below=True) > 0
+    # leaking back up but still below the target
+    for _ in range(20):
+        p *= 1.05
+        trend.update(t, p)
+        t += 0.1
+    assert p < 0.3
+    assert trend.slope > 0
+    assert trend.time_to(0.3, below=True) == 0.0
+    assert 0 < trend.time_to(0.3, below=False) < INFINITY
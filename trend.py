@@ -0,0 +1,85 @@
+# Online pressure trend.
+#
+# Two filters on log(pressure), each updated in constant time per sample:
+# an exponential average, which lags behind the samples but never goes past
+# them, for comparing against thresholds, and an alpha-beta filter giving
+# the slope. Pump-downs and leak-ups are close to exponential, so in log
+# space the slope stays nearly constant and the time until a target
+# pressure is a division.
+#
+#   trend = PressureTrend()
+#   trend.update(time.monotonic(), pressure)   # per sample
+#   trend.pressure(), trend.rate(), trend.time_to(0.3)
+#
+# alpha sets how much of each new sample goes into the averages, beta how fast
+# the slope follows; smaller values smooth more and lag more. Timestamps must
+# come from a monotonic clock, a step of the wall clock would be a slope.
+#
+# After a step, e.g. a dosing pulse, the alpha-beta level would swing past the
+# new pressure, so it is kept between the last two samples: predictions start
+# from no further than the pressure actually seen.
+
+import math
+
+INFINITY = float('inf')
+
+
+class PressureTrend(object):
+    def __init__(self, alpha=0.3, beta=0.05):
+        self.alpha = alpha
+        self.beta = beta
+        self.average = None  # exponential average of log(pressure)
+        self.level = None    # alpha-beta level of log(pressure)
+        self.slope = 0.0     # d log(pressure) / dt, per second
+        self.time = None     # timestamp of the last sample
+        self.last = None     # log of the last sample
+        self.samples = 0
+
+    def update(self, timestamp, pressure):
+        # missing or non-positive pressures are skipped
+        if pressure is None or not pressure > 0:
+            return
+        y = math.log(pressure)
+        if self.level is None:
+            self.average = self.level = self.last = y
+            self.time = timestamp
+            self.samples = 1
+            return
+        dt = timestamp - self.time
+        if dt <= 0:
+            return
+        self.average += self.alpha * (y - self.average)
+        predicted = self.level + self.slope * dt
+        residual = y - predicted
+        level = predicted + self.alpha * residual
+        self.level = min(max(level, min(y, self.last)), max(y, self.last))
+        self.slope += self.beta * residual / dt
+        self.time = timestamp
+        self.last = y
+        self.samples += 1
+
+    def pressure(self):
+        # smoothed pressure, None before the first sample
+        if self.average is None:
+            return None
+        return math.exp(self.average)
+
+    def rate(self):
+        # pressure change per second at the smoothed level
+        if self.level is None:
+            return None
+        return math.exp(self.level) * self.slope
+
+    def time_to(self, target, below=None):
+        # seconds from the last sample until the trend reaches target, inf if
+        # it is heading away, None without samples. below=True counts any
+        # level at or below target as reached, below=False any at or above
+        # it, either way 0 once the level is there
+        if self.level is None:
+            return None
+        gap = math.log(target) - self.level
+        if gap == 0 or (below is not None and (gap > 0) == below):
+            return 0.0
+        if self.slope == 0 or (gap > 0) != (self.slope > 0):
+            return INFINITY
+        return gap / self.slope